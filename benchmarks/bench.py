@@ -0,0 +1,194 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import math
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPOSITORY))
+
+from circles.parser import Parser
+from circles.interpreter import Interpreter
+from circles.program import Circle, Path as ProgramPath, Program, CircleTypes, PathTypes
+from circles.exceptions import HaltException
+from circles.profiling import Profiler
+from circles.streams import IntegerReader, IntegerWriter, BUFFER_SIZE
+
+def build_program(circle_types, path_specs):
+    circles = []
+    for i, circle_type in enumerate(circle_types):
+        circle = Circle(i, (60 + 120*i, 60), 40)
+        circle.type = circle_type
+        circles.append(circle)
+
+    paths = []
+    for i, (path_type, a, b) in enumerate(path_specs):
+        path = ProgramPath(i, path_type)
+        path.connect_circle(circles[a])
+        path.connect_circle(circles[b])
+        paths.append(path)
+
+    image = np.full((120, 120*len(circles), 3), 255, np.uint8)
+    return Program(image, circles, paths)
+
+def countdown_program(decrements=2):
+    # The input goes into a counter, which loops through the decrements while it is at least 1
+    # and then leaves through a priority path to an output circle.
+    circle_types = [CircleTypes.START, CircleTypes.NORMAL] + [CircleTypes.DECREMENT]*decrements + [CircleTypes.OUTPUT]
+    counter, first, last, output = 1, 2, 1+decrements, 2+decrements
+
+    path_specs = [(PathTypes.INPUT, 0, counter), (PathTypes.CONDITIONAL_PRIORITY, counter, first)]
+    path_specs += [(PathTypes.NORMAL, i, i+1) for i in range(first, last)]
+    path_specs += [(PathTypes.NORMAL, last, counter), (PathTypes.PRIORITY, counter, output)]
+
+    return build_program(circle_types, path_specs)
+
+# Program, inputs and whether loops may be skipped through. Step throughput is measured without
+# skipping, which would otherwise be all that gets timed.
+SYNTHETIC_PROGRAMS = {
+    "countdown": (lambda: countdown_program(2), [3_000_000], False),
+    "countdown-long-loop": (lambda: countdown_program(50), [3_000_000], False),
+    "countdown-accelerated": (lambda: countdown_program(2), [1_000_000_000], True),
+}
+
+def scaled(image, scale):
+    if scale == 1:
+        return image
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+
+def bench_parse(image, repeats):
+    stage_times = {}
+
+    for _ in range(repeats):
+        profiler = Profiler()
+        Parser(image, profiler=profiler).parse()
+        for stage, seconds in profiler.span_totals().items():
+            stage_times[stage] = min(stage_times.get(stage, math.inf), seconds)
+
+    # Memory is traced in a pass of its own so tracing doesn't slow down the timed ones
+    tracemalloc.start()
+    program = Parser(image).parse()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "shape": list(image.shape),
+        "circles": len(program.circles),
+        "paths": len(program.paths),
+        "stages": stage_times,
+        "total": sum(stage_times[stage] for stage in Parser.STAGES),
+        "peak_memory": peak_memory,
+    }
+
+def bench_run(program, inputs, repeats, accelerate_loops=False):
+    best_seconds = math.inf
+
+    for _ in range(repeats):
+        reader = IntegerReader(io.StringIO(" ".join(map(str, inputs))))
+        writer = IntegerWriter(io.StringIO(), BUFFER_SIZE)
+        interpreter = Interpreter(program, reader=reader, writer=writer, accelerate_loops=accelerate_loops)
+
+        # The halt message goes to stderr, which is for progress here
+        with contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            try:
+                interpreter.run()
+            except HaltException:
+                pass
+            best_seconds = min(best_seconds, time.perf_counter() - start)
+
+    return {
+        "steps": interpreter.step_number,
+        "seconds": best_seconds,
+        "steps_per_second": interpreter.step_number/best_seconds,
+    }
+
+def run_benchmarks(image_paths, scales, repeats):
+    results = {"parse": {}, "run": {}}
+
+    for image_path in image_paths:
+        image = cv2.imread(image_path)
+
+        for scale in scales:
+            name = f"{Path(image_path).name}@x{scale:g}"
+            print(f"parsing {name}", file=sys.stderr)
+
+            try:
+                results["parse"][name] = bench_parse(scaled(image, scale), repeats)
+            except Exception as exception:
+                results["parse"][name] = {"error": type(exception).__name__}
+
+    for name, (make_program, inputs, accelerate_loops) in SYNTHETIC_PROGRAMS.items():
+        print(f"running {name}", file=sys.stderr)
+        results["run"][name] = bench_run(make_program(), inputs, repeats, accelerate_loops)
+
+    return results
+
+def find_regressions(baseline, results, threshold, min_seconds):
+    regressions = []
+
+    for name, result in results["parse"].items():
+        base = baseline.get("parse", {}).get(name)
+        if base is None or "error" in base or "error" in result:
+            continue
+
+        for stage, seconds in result["stages"].items():
+            base_seconds = base["stages"].get(stage)
+            if base_seconds is not None and seconds > base_seconds*threshold and seconds-base_seconds > min_seconds:
+                regressions.append(f"{name} {stage}: {base_seconds:.4f}s -> {seconds:.4f}s")
+
+        if result["peak_memory"] > base["peak_memory"]*threshold:
+            regressions.append(f"{name} peak memory: {base['peak_memory']} -> {result['peak_memory']} bytes")
+
+    for name, result in results["run"].items():
+        base = baseline.get("run", {}).get(name)
+        if base is not None and result["steps_per_second"]*threshold < base["steps_per_second"]:
+            regressions.append(f"{name} steps/sec: {base['steps_per_second']:.0f} -> {result['steps_per_second']:.0f}")
+
+    return regressions
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(description="Time the parser stages and the interpreter")
+    argparser.add_argument("images", nargs="*", default=sorted(glob.glob(str(REPOSITORY / "images" / "*.png"))), help="program images to parse, all bundled images by default")
+    argparser.add_argument("-s", "--scales", type=float, nargs="+", default=[1], help="also parse the images resized by these factors")
+    argparser.add_argument("-r", "--repeats", type=int, default=3, help="runs per measurement, the fastest one counts")
+    argparser.add_argument("-o", "--output", type=str, default=None, help="write the results here instead of stdout")
+    argparser.add_argument("--save-baseline", type=str, default=None, help="write the results as a baseline to compare later runs against")
+    argparser.add_argument("--baseline", type=str, default=None, help="fail if anything regressed past the threshold compared to this baseline")
+    argparser.add_argument("--threshold", type=float, default=1.25, help="slowdown factor that counts as a regression")
+    argparser.add_argument("--min-seconds", type=float, default=0.005, help="ignore stage slowdowns smaller than this")
+    args = argparser.parse_args(argv)
+
+    results = run_benchmarks(args.images, args.scales, args.repeats)
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = find_regressions(json.load(baseline_file), results, args.threshold, args.min_seconds)
+
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
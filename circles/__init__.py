@@ -0,0 +1,3 @@
+# Bump whenever Parser.parse can produce a different Program for the same image,
+# so cached parses made by older versions stop being used.
+PARSER_VERSION = 2
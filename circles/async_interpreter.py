@@ -0,0 +1,82 @@
+import asyncio
+from collections import deque
+
+from circles.program import Program
+from circles.interpreter import Interpreter, RunStatus
+from circles.profiling import NULL_PROFILER
+
+class QueueReader:
+    # Gives out the inputs handed to it and None when it has none, which pauses the interpreter
+    def __init__(self):
+        self.values = deque()
+
+    def read(self):
+        if self.values:
+            return self.values.popleft()
+        return None
+
+class QueueWriter:
+    def __init__(self, queue:asyncio.Queue):
+        self.queue = queue
+
+    def write(self, value:int):
+        self.queue.put_nowait(value)
+
+    def flush(self):
+        pass
+
+class AsyncInterpreter:
+    # Runs a program a slice of steps at a time, giving the event loop back between slices and
+    # while waiting for input, so many programs can share one loop and one parsed Program
+    def __init__(self, program:Program, inputs:asyncio.Queue, outputs:asyncio.Queue, slice_steps:int=16384, profiler=NULL_PROFILER) -> None:
+        self.program = program
+        self.inputs = inputs
+        self.outputs = outputs
+        self.slice_steps = slice_steps
+
+        self.reader = QueueReader()
+        self.interpreter = Interpreter(program, profiler=profiler, reader=self.reader, writer=QueueWriter(outputs))
+
+    @property
+    def step_number(self):
+        return self.interpreter.step_number
+
+    @property
+    def halt_reason(self):
+        return self.interpreter.halt_reason
+
+    async def run(self, max_steps:int=None, timeout:float=None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        start_step = max(self.interpreter.step_number, 0)
+
+        while True:
+            slice_steps = self.slice_steps
+            if max_steps is not None:
+                steps_left = max_steps - (max(self.interpreter.step_number, 0) - start_step)
+                if steps_left <= 0:
+                    return RunStatus.STEP_LIMIT
+                slice_steps = min(slice_steps, steps_left)
+
+            if deadline is not None and loop.time() >= deadline:
+                return RunStatus.TIME_LIMIT
+
+            status = self.interpreter.run(slice_steps)
+
+            if status == RunStatus.NEEDS_INPUT:
+                if deadline is None:
+                    value = await self.inputs.get()
+                else:
+                    # Waiting on an input that never comes counts against the timeout too
+                    try:
+                        value = await asyncio.wait_for(self.inputs.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        return RunStatus.TIME_LIMIT
+                if value is None:
+                    # Put on the queue once no more inputs are coming, like the end of an input file
+                    raise EOFError("No more input")
+                self.reader.values.append(value)
+            elif status == RunStatus.STEP_LIMIT:
+                await asyncio.sleep(0)
+            else:
+                return status
@@ -0,0 +1,133 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from circles.cache import ProgramCache
+from circles.exceptions import CirclesException, HaltException
+from circles.interpreter import Interpreter, RunStatus
+from circles.main import load_program
+from circles.streams import IntegerReader, IntegerWriter, BUFFER_SIZE
+
+class JobTimeout(Exception):
+    pass
+
+def find_images(pattern:str):
+    if Path(pattern).is_dir():
+        return sorted(str(path) for path in Path(pattern).glob("*.png"))
+    return sorted(glob.glob(pattern, recursive=True))
+
+def inputs_for(image_path:str, inputs_suffix:str):
+    inputs_path = Path(image_path).with_suffix(inputs_suffix)
+    if inputs_path.is_file():
+        return inputs_path.read_text()
+    return ""
+
+def warm_up():
+    # Workers pay the OpenCV and SciPy imports once, not once per job
+    import circles.parser
+
+def raise_timeout(signum, frame):
+    raise JobTimeout()
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    if not seconds or not hasattr(signal, "setitimer"):
+        yield
+        return
+
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+def run_job(image_path:str, inputs_suffix:str=".in", timeout:float=None, use_cache=True, max_steps:int=None):
+    result = {
+        "path": image_path,
+        "status": "halted",
+        "output": "",
+        "halt_reason": None,
+        "error": None,
+        "steps": 0,
+        "parse_time": None,
+        "run_time": None,
+    }
+
+    cache = ProgramCache() if use_cache else None
+    interpreter = None
+    outputs = io.StringIO()
+    stage_start = time.perf_counter()
+
+    try:
+        with time_limit(timeout):
+            # Jobs already run one per core, more threads per parse would only fight over them
+            program = load_program(image_path, cache=cache, workers=1)
+        result["parse_time"] = time.perf_counter() - stage_start
+
+        # The interpreter keeps to what is left of the timeout itself, which stops it between steps
+        run_timeout = None if timeout is None else max(timeout - result["parse_time"], 0)
+
+        stage_start = time.perf_counter()
+        reader = IntegerReader(io.StringIO(inputs_for(image_path, inputs_suffix)))
+        writer = IntegerWriter(outputs, BUFFER_SIZE)
+        interpreter = Interpreter(program, reader=reader, writer=writer)
+        status = interpreter.run(max_steps, run_timeout)
+
+        if status == RunStatus.TIME_LIMIT:
+            result["status"] = "timeout"
+        elif status == RunStatus.STEP_LIMIT:
+            result["status"] = "step_limit"
+    except JobTimeout:
+        result["status"] = "timeout"
+    except HaltException:
+        result["halt_reason"] = interpreter.halt_reason
+    except CirclesException as exception:
+        result["status"] = "error"
+        result["error"] = exception.to_dict()
+    except Exception as exception:
+        result["status"] = "error"
+        result["error"] = {"type": type(exception).__name__, "message": str(exception)}
+
+    if result["parse_time"] is None:
+        result["parse_time"] = time.perf_counter() - stage_start
+    else:
+        result["run_time"] = time.perf_counter() - stage_start
+
+    if interpreter is not None:
+        result["steps"] = interpreter.step_number
+    result["output"] = outputs.getvalue()
+
+    return result
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog="python -m circles batch")
+    argparser.add_argument("images", type=str, help="directory of program images or a glob matching them")
+    argparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    argparser.add_argument("-t", "--timeout", type=float, default=None, help="seconds each program may take to parse and run")
+    argparser.add_argument("--max-steps", type=int, default=None, help="steps each program may run for")
+    argparser.add_argument("--inputs-suffix", type=str, default=".in", help="suffix of the file next to each image holding its inputs")
+    argparser.add_argument("--no-cache", action="store_true", help="always parse the images instead of reusing cached parses")
+    args = argparser.parse_args(argv)
+
+    image_paths = find_images(args.images)
+
+    if len(image_paths) == 0:
+        argparser.error(f"no program images found for {args.images}")
+
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=warm_up) as executor:
+        futures = [
+            executor.submit(run_job, image_path, args.inputs_suffix, args.timeout, not args.no_cache, args.max_steps)
+            for image_path in image_paths
+        ]
+
+        for future in as_completed(futures):
+            print(json.dumps(future.result()), flush=True)
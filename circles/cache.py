@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from circles import PARSER_VERSION
+from circles.program import Program
+
+DEFAULT_MAX_BYTES = 64*1024*1024
+
+def default_cache_dir():
+    if "CIRCLES_CACHE_DIR" in os.environ:
+        return Path(os.environ["CIRCLES_CACHE_DIR"])
+
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    if xdg_cache_home:
+        return Path(xdg_cache_home) / "circles"
+
+    return Path.home() / ".cache" / "circles"
+
+class ProgramCache:
+    # Parsed programs on disk, one file per image content hash + parser parameters.
+    # Modification times double as last-use times for least recently used eviction.
+    SUFFIX = ".circb"
+    # Entries in formats this version no longer reads, only ever deleted
+    LEGACY_SUFFIXES = (".json",)
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(image_bytes:bytes, parameters:dict=None):
+        digest = hashlib.sha256(image_bytes)
+        digest.update(json.dumps({"parser_version": PARSER_VERSION, "parameters": parameters or {}}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_path(self, key:str):
+        return self.directory / (key + self.SUFFIX)
+
+    def get(self, key:str, image_path:str=None):
+        entry_path = self.entry_path(key)
+
+        try:
+            program = Program.load(entry_path, image_path=image_path)
+        except FileNotFoundError:
+            return None
+        except (ValueError, IndexError):
+            # Half written or from an incompatible version, parse again
+            entry_path.unlink(missing_ok=True)
+            return None
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+        return program
+
+    def put(self, key:str, program:Program):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            temporary_path = self.entry_path(key).with_suffix(f".{os.getpid()}.tmp")
+            program.save(temporary_path)
+            os.replace(temporary_path, self.entry_path(key))
+
+            self.evict()
+        except OSError:
+            # A cache that can't be written to just means parsing every time
+            pass
+
+    def evict(self):
+        for suffix in self.LEGACY_SUFFIXES:
+            for entry_path in self.directory.glob("*" + suffix):
+                entry_path.unlink(missing_ok=True)
+
+        entries = []
+        for entry_path in self.directory.glob("*" + self.SUFFIX):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+
+        for _, size, entry_path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def clear(self):
+        for suffix in (self.SUFFIX,) + self.LEGACY_SUFFIXES:
+            for entry_path in self.directory.glob("*" + suffix):
+                entry_path.unlink(missing_ok=True)
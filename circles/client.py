@@ -0,0 +1,79 @@
+import argparse
+import json
+import socket
+import sys
+import threading
+from pathlib import Path
+
+def send_inputs(connection:socket.socket, stream):
+    # Inputs go out as they are read, so a program waiting on one gets it as soon as it is typed
+    try:
+        for line in stream:
+            for token in line.split():
+                try:
+                    value = int(token)
+                except ValueError:
+                    print("Invalid input", file=sys.stderr)
+                    continue
+                connection.sendall(json.dumps({"input": value}).encode() + b"\n")
+        connection.sendall(json.dumps({"end_of_input": True}).encode() + b"\n")
+    except OSError:
+        # The run is over and the server hung up
+        pass
+
+def main(argv=None):
+    from circles.main import add_parser_options, get_parser_options
+    from circles.server import default_socket_path
+
+    argparser = argparse.ArgumentParser(prog="python -m circles client", description="Run a program on a python -m circles serve server")
+    argparser.add_argument("path", type=str, help="the program, an image or a .circb, as the server can find it")
+    argparser.add_argument("-i", "--input", type=str, default=None, help="read the inputs from this file instead of stdin")
+    argparser.add_argument("--socket", type=str, default=str(default_socket_path()), help="Unix socket the server listens on")
+    argparser.add_argument("--port", type=int, default=None, help="connect to this port of localhost instead of a Unix socket")
+    argparser.add_argument("--max-steps", type=int, default=None, help="stop the program after this many steps")
+    argparser.add_argument("--timeout", type=float, default=None, help="stop the program after running for this many seconds")
+    add_parser_options(argparser)
+    args = argparser.parse_args(argv)
+
+    request = {
+        "path": str(Path(args.path).resolve()),
+        "parser_options": get_parser_options(args),
+        "max_steps": args.max_steps,
+        "timeout": args.timeout,
+    }
+
+    try:
+        if args.port is not None:
+            connection = socket.create_connection(("127.0.0.1", args.port))
+        else:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(args.socket)
+    except OSError as error:
+        sys.exit(f"Couldn't reach the server, is python -m circles serve running? ({error})")
+
+    with connection:
+        connection.sendall(json.dumps(request).encode() + b"\n")
+
+        input_stream = open(args.input) if args.input is not None else sys.stdin
+        threading.Thread(target=send_inputs, args=(connection, input_stream), daemon=True).start()
+
+        result = None
+        for line in connection.makefile("r"):
+            message = json.loads(line)
+            if "output" in message:
+                print(message["output"], flush=True)
+            else:
+                result = message
+                break
+
+    if result is None:
+        sys.exit("The server hung up before the run ended")
+
+    if result["halt_reason"] is not None:
+        print(result["halt_reason"], file=sys.stderr)
+    if result["status"] == "error":
+        print(json.dumps(result["error"]), file=sys.stderr)
+        sys.exit(1)
+    if result["status"] != "halted":
+        print(f"Program stopped after {result['steps']} steps ({result['status']})", file=sys.stderr)
+        sys.exit(2)
@@ -0,0 +1,220 @@
+from typing import Dict, List, Tuple
+
+from circles.program import CircleTypes, PathTypes, Program
+
+OP_UNDEFINED = 0
+OP_START = 1
+OP_NORMAL = 2
+OP_INCREMENT = 3
+OP_DECREMENT = 4
+OP_OUTPUT = 5
+# Only in state_ops, for states a macro-op starts at
+OP_MACRO = 6
+
+OPCODES = {
+    CircleTypes.UNDEFINED: OP_UNDEFINED,
+    CircleTypes.START: OP_START,
+    CircleTypes.NORMAL: OP_NORMAL,
+    CircleTypes.INCREMENT: OP_INCREMENT,
+    CircleTypes.DECREMENT: OP_DECREMENT,
+    CircleTypes.OUTPUT: OP_OUTPUT,
+}
+
+# Transitions that can't be decided from the table (dead ends, ambiguous paths, broken paths)
+# are left to the object-level interpreter so it raises exactly what it always did.
+UNRESOLVED = -1
+
+class CompiledProgram:
+    # A state is a (previous circle, current circle) pair. Every table below is a flat list
+    # indexed by state, or by state*2+sign where sign is int(current circle value >= 1).
+    def __init__(self, program:Program):
+        self.program = program
+
+        self.opcodes:List[int] = [OPCODES[circle.type] for circle in program.circles]
+
+        self.state_previous:List[int] = []
+        self.state_current:List[int] = []
+        self.state_index:Dict[Tuple[int, int], int] = {}
+
+        self.next_state:List[int] = []
+        self.next_path:List[int] = []
+        self.next_input:List[bool] = []
+
+        # Macro-ops by the state they start at: the normal circle they start with (or -1), the last
+        # of the normal circles straight after it, how many increments and decrements follow those
+        # and what they add up to, the state they end at and how many steps all of that is
+        self.state_ops:List[int] = []
+        self.macro_normal:List[int] = []
+        self.macro_last_normal:List[int] = []
+        self.macro_crements:List[int] = []
+        self.macro_delta:List[int] = []
+        self.macro_target:List[int] = []
+        self.macro_steps:List[int] = []
+
+        self.build()
+        self.fold()
+
+    def add_state(self, previous:int, current:int):
+        key = (previous, current)
+        if key not in self.state_index:
+            self.state_index[key] = len(self.state_previous)
+            self.state_previous.append(previous)
+            self.state_current.append(current)
+        return self.state_index[key]
+
+    def build(self):
+        circles = self.program.circles
+
+        for circle in circles:
+            if circle.type == CircleTypes.START:
+                self.add_state(circle.index, circle.index)
+
+            for path in circle.paths:
+                other = path.connected_circle_that_is_not(circle)
+                if other is not None:
+                    self.add_state(circle.index, other.index)
+
+        state = 0
+        while state < len(self.state_previous):
+            previous = circles[self.state_previous[state]]
+            current = circles[self.state_current[state]]
+
+            for value in (0, 1):
+                path = self.resolve(previous, current, value)
+
+                if path is None:
+                    self.next_state.append(UNRESOLVED)
+                    self.next_path.append(UNRESOLVED)
+                    self.next_input.append(False)
+                else:
+                    next_circle = path.connected_circle_that_is_not(current)
+                    self.next_state.append(self.add_state(current.index, next_circle.index))
+                    self.next_path.append(path.index)
+                    self.next_input.append(path.type == PathTypes.INPUT)
+
+            state += 1
+
+    def is_crement_step(self, state:int):
+        # Only normal circles are ever written to, so crement circles always have the value 0
+        # and always leave the same way
+        return (
+            self.opcodes[self.state_current[state]] in (OP_INCREMENT, OP_DECREMENT)
+            and self.next_state[state*2] != UNRESOLVED
+            and not self.next_input[state*2]
+        )
+
+    def is_straight_normal_step(self, state:int):
+        # A normal circle with one way out whatever its value is
+        return (
+            self.opcodes[self.state_current[state]] == OP_NORMAL
+            and self.next_state[state*2] == self.next_state[state*2+1] != UNRESOLVED
+            and not self.next_input[state*2]
+            and not self.next_input[state*2+1]
+        )
+
+    def measure_runs(self, is_step, combine, empty):
+        # For every state, how many steps the straight run of is_step states from it has, what
+        # combine adds up over them and the state after the run. Runs are measured from their ends
+        # backwards so each state is only walked once.
+        state_count = len(self.state_previous)
+        run_steps = [0]*state_count
+        run_value = [empty]*state_count
+        run_end = list(range(state_count))
+        measured = [False]*state_count
+
+        for state in range(state_count):
+            chain = []
+            chain_states = set()
+            end = state
+            while not measured[end] and end not in chain_states and is_step(end):
+                chain.append(end)
+                chain_states.add(end)
+                end = self.next_state[end*2]
+
+            if measured[end]:
+                steps, value, end = run_steps[end], run_value[end], run_end[end]
+            else:
+                # The run stops at something else, or loops back into itself
+                steps, value = 0, empty
+
+            for chain_state in reversed(chain):
+                steps += 1
+                value = combine(chain_state, value)
+                run_steps[chain_state] = steps
+                run_value[chain_state] = value
+                run_end[chain_state] = end
+                measured[chain_state] = True
+
+        return run_steps, run_value, run_end
+
+    def fold(self):
+        # Straight-line runs of normal circles with one way out followed by increments and
+        # decrements become macro-ops. Only the first normal circle of a run can have an input or a
+        # crementation waiting for it, the others just become the last normal circle.
+        crement_steps, crement_delta, crement_end = self.measure_runs(
+            self.is_crement_step,
+            lambda state, delta: delta + (1 if self.opcodes[self.state_current[state]] == OP_INCREMENT else -1),
+            0,
+        )
+        normal_steps, normal_last, normal_end = self.measure_runs(
+            self.is_straight_normal_step,
+            lambda state, last: last if last >= 0 else self.state_current[state],
+            -1,
+        )
+
+        for state in range(len(self.state_previous)):
+            normal = last_normal = -1
+            start = state
+            if normal_steps[state]:
+                normal = self.state_current[state]
+                last_normal = normal_last[state]
+                start = normal_end[state]
+
+            crements = crement_steps[start]
+            steps = normal_steps[state] + crements
+
+            if steps < 2:
+                self.state_ops.append(self.opcodes[self.state_current[state]])
+                self.macro_normal.append(-1)
+                self.macro_last_normal.append(-1)
+                self.macro_crements.append(0)
+                self.macro_delta.append(0)
+                self.macro_target.append(state)
+                self.macro_steps.append(0)
+            else:
+                self.state_ops.append(OP_MACRO)
+                self.macro_normal.append(normal)
+                self.macro_last_normal.append(last_normal)
+                self.macro_crements.append(crements)
+                self.macro_delta.append(crement_delta[start])
+                self.macro_target.append(crement_end[start])
+                self.macro_steps.append(steps)
+
+    @staticmethod
+    def resolve(previous, current, value:int):
+        next_paths = []
+        for path in current.paths:
+            other = path.connected_circle_that_is_not(current)
+            if other is None:
+                return None
+            if other.index != previous.index:
+                next_paths.append(path)
+
+        if len(next_paths) < 1:
+            return None
+
+        priorities = [path.priority_for_value(value) for path in next_paths]
+        max_priority = max(priorities)
+
+        possible_next_paths = [path for path, priority in zip(next_paths, priorities) if priority == max_priority]
+
+        if len(possible_next_paths) > 1:
+            return None
+
+        return possible_next_paths[0]
+
+def compile_program(program:Program):
+    # Programs don't change, so the tables are built once and shared by every run
+    if program.compiled is None:
+        program.compiled = CompiledProgram(program)
+    return program.compiled
@@ -13,20 +13,21 @@ def display_and_wait(img, winname="Press any key. Press 'q' to quit."):
 def distance_transform(img, dist_type=cv2.DIST_L2, mask_size=0):
     return cv2.distanceTransform(img, dist_type, mask_size)
 
-def find_contours(img, retr=cv2.RETR_TREE, approx=cv2.CHAIN_APPROX_SIMPLE):
-    return cv2.findContours(img, retr, approx)
+def find_contours(img, retr=cv2.RETR_TREE, approx=cv2.CHAIN_APPROX_SIMPLE, offset=(0, 0)):
+    return cv2.findContours(img, retr, approx, offset=offset)
 
-def get_hough_circles(img, debug=None, min_dist=50, max_radius = None, param1=100, param2=50):
+def get_hough_circles(img, debug=None, min_dist=50, max_radius = None, param1=100, param2=50, min_radius=0, dp=1):
     if max_radius is None:
         max_radius = np.min(img.shape)
 
     circles = cv2.HoughCircles(
         image=img,
         method=cv2.HOUGH_GRADIENT,
-        dp=1,
+        dp=dp,
         minDist=min_dist,
         param1=param1,
         param2=param2,
+        minRadius=min_radius,
         maxRadius=max_radius,
     )
 
@@ -40,19 +41,67 @@ def get_hough_circles(img, debug=None, min_dist=50, max_radius = None, param1=10
 
     return circles
 
-def morph(img, kernel_size=2, morph=cv2.MORPH_BLACKHAT):
+def morph(img, kernel_size=2, morph=cv2.MORPH_BLACKHAT, dst=None):
     kernel = np.ones((kernel_size,kernel_size),np.uint8)
-    return cv2.morphologyEx(img, morph, kernel)
+    return cv2.morphologyEx(img, morph, kernel, dst=dst)
 
 def morph_func(img, func, kernel_size=2, iterations=1):
     kernel = np.ones((kernel_size,kernel_size),np.uint8)
     return func(img, kernel, iterations=iterations)
 
-def mask_contours(cnts, img, color = 255):
+def mask_contours(cnts, img, color = 255, offset=(0, 0)):
     mask = np.zeros_like(img)
-    cv2.drawContours(mask, cnts, -1, color, -1, cv2.LINE_AA)
+    cv2.drawContours(mask, cnts, -1, color, -1, cv2.LINE_AA, offset=offset)
     return mask
 
+def roi_around(x, y, w, h, pad, shape):
+    # (x0, y0, x1, y1) of the box padded on every side and clipped to an image of the given shape
+    return max(x-pad, 0), max(y-pad, 0), min(x+w+pad, shape[1]), min(y+h+pad, shape[0])
+
+def contour_roi(cnt, pad, shape):
+    return roi_around(*cv2.boundingRect(cnt), pad, shape)
+
+def circle_roi(center, radius, pad, shape):
+    return roi_around(center[0]-radius, center[1]-radius, radius*2+1, radius*2+1, pad, shape)
+
+def clip_box(box, shape):
+    x0, y0, x1, y1 = box
+    return max(int(x0), 0), max(int(y0), 0), min(int(x1), shape[1]), min(int(y1), shape[0])
+
+def boxes_overlap(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def merge_boxes(boxes):
+    # Boxes that overlap or touch are replaced by the box around both until none do
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i+1, len(boxes)):
+                if boxes_overlap(boxes[i], boxes[j]):
+                    boxes[i] = union_roi([boxes[i], boxes[j]])
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return sorted(boxes)
+
+def touches_inner_border(mask, box, shape):
+    # Whether anything in the mask of the box is on an edge of the box that isn't an edge of the image
+    x0, y0, x1, y1 = box
+    return (
+        (y0 > 0 and mask[0].any()) or
+        (y1 < shape[0] and mask[-1].any()) or
+        (x0 > 0 and mask[:, 0].any()) or
+        (x1 < shape[1] and mask[:, -1].any())
+    )
+
+def union_roi(rois):
+    x0s, y0s, x1s, y1s = zip(*rois)
+    return min(x0s), min(y0s), max(x1s), max(y1s)
+
 def get_contour_centroid(cnt):
     M = cv2.moments(cnt)
     if M['m00'] ==0:
@@ -1,17 +1,27 @@
 from typing import List
-import cv2
 
 from circles.program import Program, Circle, Path
-from circles.cv_helper import display_and_wait, put_text
 
 class CirclesException(Exception):
+    circles:List[Circle] = []
+    paths:List[Path] = []
+
     def __init__(self, message, program:Program):
         self.message = message
         self.program = program
         super().__init__(self.message)
-        self.show_exception()
+
+    def to_dict(self):
+        return {
+            "type": type(self).__name__,
+            "message": self.message,
+            "circles": [circle.index for circle in self.circles],
+            "paths": [path.index for path in self.paths],
+        }
 
     def show_exception(self):
+        from circles.cv_helper import display_and_wait, put_text
+
         exception_image = self.draw_exception()
 
         image_height, _ = exception_image.shape[:2]
@@ -102,4 +112,7 @@ class CircleAndPathException(CirclesException):
         return exception_image
 
 class AmbiguousPathsException(CircleAndPathException):
+    pass
+
+class BrokenPathException(PathException):
     pass
\ No newline at end of file
@@ -1,10 +1,14 @@
 from collections import defaultdict
 from enum import Enum, auto
-import cv2
+import sys
+import threading
+import time
 
 from circles.program import PathTypes, Program, CircleTypes, Path
+from circles.compiler import compile_program, OP_NORMAL, OP_INCREMENT, OP_DECREMENT, OP_OUTPUT, OP_START, OP_MACRO
 from circles.exceptions import *
-from circles.cv_helper import display_and_wait
+from circles.profiling import NULL_PROFILER
+from circles.streams import PromptReader, IntegerWriter
 
 class CrementModes(Enum):
     CREMENTING = auto()
@@ -14,16 +18,57 @@ class InputModes(Enum):
     WAITING_FOR_INPUT = auto()
     HOLDING_INPUT = auto()
 
+class RunStatus(Enum):
+    # Why run returned before the program halted, calling run again carries on from there
+    STEP_LIMIT = auto()
+    TIME_LIMIT = auto()
+    CANCELLED = auto()
+    # The reader had no input yet, run again once it does
+    NEEDS_INPUT = auto()
+
+# Steps between looking at the budgets, often enough that a time budget is overshot by milliseconds
+BUDGET_CHECK_INTERVAL = 65536
+
+# Steps between looking for a loop to skip ahead in, doubled every time none is found, and the
+# longest loop iteration that is looked for
+LOOP_PROBE_INTERVAL = 65536
+LOOP_TRACE_STEPS = 1024
+
+# What run_transitions stops with when it is time to look for a loop
+LOOP_PROBE = object()
+
 class Interpreter:
-    def __init__(self, program:Program, do_debug=False) -> None:
+    def __init__(self, program:Program, do_debug=False, profiler=NULL_PROFILER, reader=None, writer=None, cancel_event:threading.Event=None, accelerate_loops=True, trace=None, checked=True) -> None:
         self.program = program
         self.do_debug = do_debug
+        self.profiler = profiler
+
+        self.reader = reader or PromptReader()
+        self.writer = writer or IntegerWriter()
+
+        # Set from another thread to stop run at the next budget check
+        self.cancel_event = cancel_event
+        self.limit_step:int = None
+        self.deadline:float = None
+
+        # Value of every circle by index, the program itself is never written to
+        self.values:List[int] = [0]*len(program.circles)
+
+        self.accelerate_loops = accelerate_loops
+        # A TraceRecorder every step is recorded to
+        self.trace = trace
+        # Off only for programs validate_program found no errors in, steps then skip looking for
+        # output errors and ambiguous paths
+        self.checked = checked
+        self.probe_interval = LOOP_PROBE_INTERVAL
+        self.probe_step = LOOP_PROBE_INTERVAL
 
         self.step_number = -1
 
         self.previous:Circle = None
         self.current:Circle = None
         self.next:Circle = None
+        self.last_path:Path = None
 
         self.last_normal_circle:Circle = None
 
@@ -59,14 +104,333 @@ class Interpreter:
         self.current = self.get_start_circle()
         self.previous = self.current
 
-    def run(self):
-        self.start()
+    def run(self, max_steps:int=None, timeout:float=None):
+        if self.step_number<0:
+            self.start()
+            self.step_number+=1
 
-        self.step_number+=1
+        if self.input_pending():
+            self.input_value = self.read_input()
+            if self.input_value is None:
+                return RunStatus.NEEDS_INPUT
+
+        self.limit_step = None if max_steps is None else self.step_number + max_steps
+        self.deadline = None if timeout is None else time.perf_counter() + timeout
+
+        with self.profiler.span("run", "interpreter"):
+            try:
+                if self.trace is not None:
+                    return self.run_traced()
+                elif self.do_debug:
+                    return self.run_stepping()
+                elif self.profiler.enabled:
+                    return self.run_profiled()
+                else:
+                    return self.run_compiled()
+            finally:
+                self.writer.flush()
+
+    def next_budget_check(self, step_number:int):
+        check_step = step_number + BUDGET_CHECK_INTERVAL
+        if self.limit_step is not None:
+            check_step = min(check_step, self.limit_step)
+        return check_step
+
+    def budget_status(self, step_number:int):
+        if self.limit_step is not None and step_number >= self.limit_step:
+            return RunStatus.STEP_LIMIT
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return RunStatus.TIME_LIMIT
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            return RunStatus.CANCELLED
+        return None
+
+    def run_stepping(self):
+        check_step = self.next_budget_check(self.step_number)
 
         while not self.halted:
+            if self.step_number >= check_step:
+                status = self.budget_status(self.step_number)
+                if status is not None:
+                    return status
+                check_step = self.next_budget_check(self.step_number)
+
+            self.step()
+
+            if self.input_pending():
+                return RunStatus.NEEDS_INPUT
+
+    def run_traced(self):
+        # Every step goes through the object-level stepper, loops aren't skipped so no step is
+        # missing from the trace
+        trace = self.trace
+        if trace.first_step is None:
+            trace.begin(self.step_number, self.values)
+        check_step = self.next_budget_check(self.step_number)
+
+        while not self.halted:
+            if self.step_number >= check_step:
+                status = self.budget_status(self.step_number)
+                if status is not None:
+                    return status
+                check_step = self.next_budget_check(self.step_number)
+
+            circle_index = self.current.index
+            value = self.values[circle_index]
+            self.step()
+            new_value = self.values[circle_index]
+            trace.record(circle_index, self.last_path.index, new_value - value, new_value)
+
+            if self.input_pending():
+                return RunStatus.NEEDS_INPUT
+
+    def input_pending(self):
+        # An input path was taken while the reader had nothing to give
+        return self.input_mode == InputModes.HOLDING_INPUT and self.input_value is None
+
+    def run_profiled(self):
+        # Timing every step only makes sense on the object-level stepper, the compiled loop
+        # stays free of instrumentation.
+        profiler = self.profiler
+        start_step = self.step_number
+        check_step = self.next_budget_check(self.step_number)
+
+        try:
+            while not self.halted:
+                if self.step_number >= check_step:
+                    status = self.budget_status(self.step_number)
+                    if status is not None:
+                        return status
+                    check_step = self.next_budget_check(self.step_number)
+
+                circle_type = self.current.type.name
+                start = time.perf_counter()
+                try:
+                    self.step()
+                finally:
+                    profiler.add_time(f"interpreter.{circle_type}", time.perf_counter() - start)
+
+                if self.input_pending():
+                    return RunStatus.NEEDS_INPUT
+        finally:
+            profiler.count("interpreter.steps", self.step_number - start_step)
+
+    def run_compiled(self):
+        while True:
+            status = self.run_transitions()
+            if status is not LOOP_PROBE:
+                return status
+            self.accelerate_loop()
+
+    def run_transitions(self):
+        compiled = compile_program(self.program)
+        circles = self.program.circles
+
+        opcodes = compiled.opcodes
+        state_ops = compiled.state_ops
+        state_current = compiled.state_current
+        next_state = compiled.next_state
+        next_input = compiled.next_input
+
+        macro_normal = compiled.macro_normal
+        macro_last_normal = compiled.macro_last_normal
+        macro_crements = compiled.macro_crements
+        macro_delta = compiled.macro_delta
+        macro_target = compiled.macro_target
+        macro_steps = compiled.macro_steps
+
+        values = self.values
+
+        state = compiled.state_index[(self.previous.index, self.current.index)]
+        step_number = self.step_number
+
+        crementing = self.crement_mode == CrementModes.CREMENTING
+        crement_count = self.crement_count
+        holding_input = self.input_mode == InputModes.HOLDING_INPUT
+        input_value = self.input_value
+        last_normal = -1 if self.last_normal_circle is None else self.last_normal_circle.index
+
+        write = self.writer.write
+        count = self.profiler.count
+        checked = self.checked
+
+        probe_step = self.probe_step if self.accelerate_loops else None
+        check_step = self.next_budget_check(step_number)
+        if probe_step is not None:
+            check_step = min(check_step, probe_step)
+        status = None
+
+        unresolved_transition = False
+
+        try:
+            while True:
+                if step_number >= check_step:
+                    status = self.budget_status(step_number)
+                    if status is not None:
+                        break
+                    if probe_step is not None and step_number >= probe_step:
+                        status = LOOP_PROBE
+                        break
+                    check_step = self.next_budget_check(step_number)
+                    if probe_step is not None:
+                        check_step = min(check_step, probe_step)
+
+                current = state_current[state]
+                op = state_ops[state]
+
+                if op == OP_MACRO:
+                    # Taken whole only when it ends before the next budget check, so step limits
+                    # stay exact. Otherwise the circle it starts at runs like any other.
+                    if step_number + macro_steps[state] <= check_step:
+                        normal = macro_normal[state]
+                        if normal >= 0:
+                            last_normal = macro_last_normal[state]
+                            if holding_input:
+                                values[normal] = input_value
+                                holding_input = False
+                            if crementing:
+                                values[normal] += crement_count
+                                crementing = False
+                                crement_count = 0
+                        if macro_crements[state]:
+                            crementing = True
+                            crement_count += macro_delta[state]
+                        step_number += macro_steps[state]
+                        state = macro_target[state]
+                        continue
+                    op = opcodes[current]
+
+                if op == OP_NORMAL:
+                    last_normal = current
+                    if holding_input:
+                        values[current] = input_value
+                        holding_input = False
+                    if crementing:
+                        values[current] += crement_count
+                        crementing = False
+                        crement_count = 0
+                elif op == OP_INCREMENT:
+                    crementing = True
+                    crement_count += 1
+                elif op == OP_DECREMENT:
+                    crementing = True
+                    crement_count -= 1
+                elif op == OP_OUTPUT:
+                    if checked and (last_normal < 0 or crementing):
+                        break
+                    write(values[last_normal])
+                    count("interpreter.outputs")
+                elif op == OP_START:
+                    if step_number != 0:
+                        break
+
+                transition = state+state+(values[current] >= 1)
+                next_state_index = next_state[transition]
+
+                if next_state_index < 0:
+                    unresolved_transition = True
+                    break
+
+                if next_input[transition] and not holding_input:
+                    holding_input = True
+                    input_value = self.read_input()
+                    if input_value is None:
+                        # The input is only used at the next normal circle, so the step can finish
+                        # and the input be filled in when run is called again
+                        state = next_state_index
+                        step_number += 1
+                        status = RunStatus.NEEDS_INPUT
+                        break
+
+                state = next_state_index
+                step_number += 1
+        finally:
+            self.previous = circles[compiled.state_previous[state]]
+            self.current = circles[compiled.state_current[state]]
+            self.step_number = step_number
+            self.crement_mode = CrementModes.CREMENTING if crementing else CrementModes.NOT_CREMENTING
+            self.crement_count = crement_count
+            self.input_mode = InputModes.HOLDING_INPUT if holding_input else InputModes.WAITING_FOR_INPUT
+            self.input_value = input_value
+            self.last_normal_circle = None if last_normal < 0 else circles[last_normal]
+
+        if status is not None:
+            return status
+
+        # Whatever else stopped the loop is an error or a halt, which the object-level methods report
+        if unresolved_transition:
+            self.go_next()
+        else:
+            self.do_current_circle()
+
+    def accelerate_loop(self):
+        # Follows the program with the object-level stepper until it is back in the same (previous,
+        # current) state. Without inputs or outputs on the way every normal circle changes by the
+        # same amount each time around, so it can skip straight to the last time around before
+        # one of the values the way was chosen by would choose differently.
+        compiled = compile_program(self.program)
+        start = (self.previous.index, self.current.index)
+        start_step = self.step_number
+        start_state = (list(self.values), self.crement_mode, self.crement_count, self.input_mode, self.last_normal_circle)
+        limit_step = self.limit_step
+        tests = []
+
+        self.probe_interval *= 2
+
+        while True:
+            if self.step_number - start_step >= LOOP_TRACE_STEPS or (limit_step is not None and self.step_number >= limit_step):
+                break
+
+            state = compiled.state_index[(self.previous.index, self.current.index)]
+            transitions = (state*2, state*2+1)
+            if compiled.opcodes[self.current.index] == OP_OUTPUT or any(compiled.next_input[transition] for transition in transitions):
+                break
+
+            current = self.current
             self.step()
 
+            if compiled.next_state[state*2] != compiled.next_state[state*2+1]:
+                tests.append((current.index, self.values[current.index]))
+
+            if (self.previous.index, self.current.index) != start:
+                continue
+
+            if start_state[1:] == (self.crement_mode, self.crement_count, self.input_mode, self.last_normal_circle):
+                self.skip_iterations(start_state[0], self.step_number - start_step, tests)
+            break
+
+        self.probe_step = self.step_number + self.probe_interval
+
+    def skip_iterations(self, start_values:List[int], iteration_steps:int, tests):
+        deltas = [value - start_value for value, start_value in zip(self.values, start_values)]
+
+        iterations = None
+        if self.limit_step is not None:
+            iterations = (self.limit_step - self.step_number)//iteration_steps
+
+        for circle_index, value in tests:
+            delta = deltas[circle_index]
+            if value >= 1 and delta < 0:
+                safe_iterations = (value-1)//-delta
+            elif value < 1 and delta > 0:
+                safe_iterations = -value//delta
+            else:
+                continue
+            if iterations is None or safe_iterations < iterations:
+                iterations = safe_iterations
+
+        if iterations is None:
+            # Nothing ever changes the way, the program goes around forever
+            iterations = max(self.probe_interval//iteration_steps, 1)
+
+        if iterations > 0:
+            for circle_index, delta in enumerate(deltas):
+                if delta:
+                    self.values[circle_index] += delta*iterations
+            self.step_number += iteration_steps*iterations
+
+        self.probe_interval = LOOP_PROBE_INTERVAL
+
     def step(self):
         if self.do_debug:
             self.show_where_things_are()
@@ -80,6 +444,8 @@ class Interpreter:
             self.step_number+=1
 
     def show_where_things_are(self):
+        from circles.cv_helper import display_and_wait
+
         labeled_image = self.program.get_labeled_image()
 
         self.current.draw(labeled_image, (0,255,0))
@@ -91,7 +457,8 @@ class Interpreter:
 
     def halt(self, reason:str, SpecificException=HaltException):
         self.halt_reason = f"Program halted because {reason}"
-        print(self.halt_reason)
+        self.writer.flush()
+        print(self.halt_reason, file=sys.stderr)
         self.halted = True
         raise SpecificException(self.halt_reason, self.program, [self.current])
 
@@ -103,11 +470,11 @@ class Interpreter:
             self.last_normal_circle = self.current
 
             if self.input_mode == InputModes.HOLDING_INPUT:
-                self.current.value = self.input_value
+                self.values[self.current.index] = self.input_value
                 self.input_mode = InputModes.WAITING_FOR_INPUT
             
             if self.crement_mode == CrementModes.CREMENTING:
-                self.current.value += self.crement_count
+                self.values[self.current.index] += self.crement_count
                 self.crement_mode = CrementModes.NOT_CREMENTING
                 self.crement_count = 0
         elif self.current.type == CircleTypes.INCREMENT:
@@ -117,25 +484,43 @@ class Interpreter:
             self.crement_mode = CrementModes.CREMENTING
             self.crement_count -= 1
         elif self.current.type == CircleTypes.OUTPUT:
-            if self.last_normal_circle is None:
+            if not self.checked:
+                self.writer.write(self.values[self.last_normal_circle.index])
+                self.profiler.count("interpreter.outputs")
+            elif self.last_normal_circle is None:
                 raise NoNormalCircleVisitedException(self.program, self.current)
             elif self.crement_mode == CrementModes.CREMENTING:
                 raise NoNormalCircleAfterCrementationException(self.program, [self.current, self.previous])
             else:
-                print(self.last_normal_circle.value)
+                self.writer.write(self.values[self.last_normal_circle.index])
+                self.profiler.count("interpreter.outputs")
     
     def go_next(self):
+        if not self.checked:
+            # The compiled tables already know the one path there is, only dead ends are left to
+            # the checks below. Branch decisions aren't counted this way.
+            compiled = compile_program(self.program)
+            state = compiled.state_index[(self.previous.index, self.current.index)]
+            path_index = compiled.next_path[state*2 + (self.values[self.current.index] >= 1)]
+            if path_index >= 0:
+                return self.take_path(self.program.paths[path_index])
+
         next_paths = self.current.paths_that_dont_connect_to(self.previous)
 
         next_paths_len = len(next_paths)
 
+        if next_paths_len > 1:
+            self.profiler.count("interpreter.branch_decisions")
+
         if next_paths_len < 1:
             self.halt("there are no possible paths without going back", DeadEndException)
 
         next_path_priorities = defaultdict(list[Path])
 
+        current_value = self.values[self.current.index]
+
         for next_path in next_paths:
-            next_path_priority = next_path.get_priority(self.current)
+            next_path_priority = next_path.priority_for_value(current_value)
             next_path_priorities[next_path_priority].append(next_path)
 
         max_of_next_path_priority = max(next_path_priorities.keys())
@@ -147,17 +532,22 @@ class Interpreter:
         if possible_next_paths_len > 1:
             raise AmbiguousPathsException("Too many possible paths", self.program, [self.current], possible_next_paths)
         
-        the_next_path = possible_next_paths[0]
+        self.take_path(possible_next_paths[0])
 
+    def take_path(self, the_next_path:Path):
         if the_next_path.type == PathTypes.INPUT and self.input_mode == InputModes.WAITING_FOR_INPUT:
             self.input_mode = InputModes.HOLDING_INPUT
-            self.input_value = None
-            while self.input_value is None:
-                try:
-                    self.input_value = int(input("Input an integer: "))
-                except ValueError:
-                    print("Invalid input")
+            self.input_value = self.read_input()
 
         next_circle = the_next_path.connected_circle_that_is_not(self.current)
+        self.last_path = the_next_path
         self.previous = self.current
-        self.current = next_circle
\ No newline at end of file
+        self.current = next_circle
+
+    def read_input(self):
+        # Outputs so far should be out before the reader asks for anything
+        self.writer.flush()
+        value = self.reader.read()
+        if value is not None:
+            self.profiler.count("interpreter.inputs")
+        return value
@@ -1,29 +1,299 @@
 import argparse
-import cv2
+import contextlib
+import importlib
+import json
+import sys
 from pathlib import Path
 
-from circles.parser import Parser, DebugParser
+from circles.cache import ProgramCache
 from circles.interpreter import Interpreter
-from circles.cv_helper import display_and_wait
+from circles.program import Program
+from circles.exceptions import CirclesException, HaltException
+from circles.profiling import Profiler, NULL_PROFILER, peak_memory
+from circles.streams import PromptReader, IntegerReader, IntegerWriter, BUFFER_SIZE
+
+def parse_image_bytes(image_bytes:bytes, parser_options:dict, profiler=NULL_PROFILER, workers:int=None):
+    import cv2
+    import numpy as np
+    from circles.parser import Parser
+
+    with profiler.span("decode", "parse"):
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if parser_options.get("low_memory") and image is not None:
+            # Parsing only ever looks at the grayscale image, so low_memory drops the colours right
+            # away. Converted the way Parser.threshold does it, IMREAD_GRAYSCALE weighs the channels
+            # the other way around and thresholds coloured strokes differently
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+    # The number of workers doesn't change the parse, so it isn't one of the parser options the
+    # cache is keyed on
+    parser = Parser(image, profiler=profiler, workers=workers, **parser_options)
+    return parser.parse()
+
+def load_program(path:str, parser_options:dict=None, cache:ProgramCache=None, profiler=NULL_PROFILER, workers:int=None):
+    if Path(path).suffix == ".circb":
+        with profiler.span("load", "parse"):
+            return Program.load(path)
+
+    parser_options = parser_options or {}
+    image_bytes = Path(path).read_bytes()
+
+    if cache is not None:
+        with profiler.span("cache_lookup", "cache"):
+            key = cache.key(image_bytes, parser_options)
+            program = cache.get(key, path)
+        if program is not None:
+            profiler.count("cache.hits")
+            return program
+        profiler.count("cache.misses")
+
+    program = parse_image_bytes(image_bytes, parser_options, profiler, workers)
+
+    if program is not None:
+        program.image_path = path
+        if cache is not None:
+            cache.put(key, program)
+
+    return program
+
+def add_parser_options(argparser:argparse.ArgumentParser):
+    argparser.add_argument("--pyramid-level", type=int, default=0, help="look for circles on the image downscaled 2**N times first, faster on big images")
+    argparser.add_argument("--adaptive", action="store_true", help="size the circle detection after the stroke width and circles measured on the image, for images drawn at any resolution")
+    argparser.add_argument("--low-memory", action="store_true", help="drop the colours of the image as soon as it is read and keep fewer full size copies of it around while parsing, for big images on little memory")
+
+def get_parser_options(args):
+    # Only options that change the parse, the cache is keyed on them
+    parser_options = {}
+    if args.pyramid_level:
+        parser_options["pyramid_level"] = args.pyramid_level
+    if args.adaptive:
+        parser_options["adaptive"] = True
+    if args.low_memory:
+        parser_options["low_memory"] = True
+    return parser_options
+
+# Commands run instead of a program when they are the first argument, by the module and function
+# that handle the rest of the arguments, imported only when the command is used
+SUBCOMMANDS = {
+    "batch": ("circles.batch", "main", "run every program image in a directory or glob in parallel and report how each one went"),
+    "compile": ("circles.main", "compile_main", "parse a program image once and save the result as .circb"),
+    "replay": ("circles.main", "replay_main", "show the program at steps of a trace recorded with --trace"),
+    "suite": ("circles.main", "suite_main", "run a program once for every line of inputs, all runs at once"),
+    "serve": ("circles.server", "main", "keep parse workers and parsed programs around for client"),
+    "client": ("circles.client", "main", "run a program on a serve server"),
+}
+
+def subcommands_help():
+    width = max(len(name) for name in SUBCOMMANDS)
+    lines = [f"  {name:<{width}}  {description}" for name, (_, _, description) in SUBCOMMANDS.items()]
+    return "commands, see python -m circles COMMAND --help:\n" + "\n".join(lines)
 
 def main():
-    argparser = argparse.ArgumentParser()
-    argparser.add_argument("path", type=str, help="Path to the file to interpret")
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        module, function, _ = SUBCOMMANDS[sys.argv[1]]
+        return getattr(importlib.import_module(module), function)(sys.argv[2:])
+
+    argparser = argparse.ArgumentParser(prog="python -m circles", epilog=subcommands_help(), formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("path", type=str, help="Path to the file to interpret, an image or a .circb made by compile")
     argparser.add_argument("-v", "--vision", action="store_true", help="show what parser sees")
     argparser.add_argument("-d", "--debug", action="store_true", help="step through the running of the program")
+    argparser.add_argument("--no-cache", action="store_true", help="always parse the image instead of reusing a cached parse")
+    add_parser_options(argparser)
+    argparser.add_argument("-i", "--input", type=str, default=None, help="read the inputs from this file instead of asking for them")
+    argparser.add_argument("-o", "--output", type=str, default=None, help="write the outputs to this file")
+    argparser.add_argument("--no-prompt", action="store_true", help="read whitespace separated inputs from stdin without asking and buffer the outputs, for pipelines")
+    argparser.add_argument("--parse-workers", type=int, default=None, help="threads to parse the image on, one per core by default")
+    argparser.add_argument("--max-steps", type=int, default=None, help="stop the program after this many steps")
+    argparser.add_argument("--timeout", type=float, default=None, help="stop the program after running for this many seconds")
+    argparser.add_argument("--trace", type=str, default=None, help="record every step to this file, look at any step of it with python -m circles replay")
+    argparser.add_argument("--trace-last", type=int, default=None, help="only keep the last N steps in the --trace file")
+    argparser.add_argument("--validate", action="store_true", help="look for every error the program can run into before running it, and run it without checking for them if there are none")
+    argparser.add_argument("--headless", action="store_true", help="never open windows, report errors as JSON on stderr")
+    argparser.add_argument("--profile", type=str, default=None, help="write timings of the parse and run stages to this file")
+    argparser.add_argument("--profile-format", choices=["json", "chrome"], default="json", help="format of the --profile file, chrome is the Chrome trace event format")
     args = argparser.parse_args()
 
+    if args.headless and (args.vision or args.debug):
+        argparser.error("--vision and --debug need a display, they can't be used with --headless")
+
+    if args.trace_last is not None and args.trace_last < 1:
+        argparser.error("--trace-last has to keep at least 1 step")
+
     assert Path(args.path).is_file(), "File does not exist"
-    
-    parser = Parser(cv2.imread(args.path))
-    parser.parse()
-    parsed_program = parser.program
+
+    profiler = Profiler() if args.profile else NULL_PROFILER
+
+    try:
+        run_program(args, profiler)
+    finally:
+        if args.profile:
+            profiler.write(args.profile, args.profile_format)
+
+def compile_main(argv=None):
+    argparser = argparse.ArgumentParser(prog="python -m circles compile", description="Parse a program image once and save the result as .circb")
+    argparser.add_argument("image", type=str, help="program image to parse")
+    argparser.add_argument("output", type=str, help="where to write the .circb file")
+    add_parser_options(argparser)
+    argparser.add_argument("--parse-workers", type=int, default=None, help="threads to parse the image on, one per core by default")
+    args = argparser.parse_args(argv)
+
+    assert Path(args.image).is_file(), "File does not exist"
+
+    parser_options = get_parser_options(args)
+    program = parse_image_bytes(Path(args.image).read_bytes(), parser_options, workers=args.parse_workers)
+
+    if program is None:
+        sys.exit(f"Couldn't parse {args.image}")
+
+    program.save(args.output)
+
+    if args.low_memory:
+        report_peak_memory()
+
+def replay_main(argv=None):
+    argparser = argparse.ArgumentParser(prog="python -m circles replay", description="Show the program at steps of a trace recorded with --trace")
+    argparser.add_argument("path", type=str, help="the program the trace was recorded from, an image or a .circb")
+    argparser.add_argument("trace", type=str, help="trace file recorded with --trace")
+    argparser.add_argument("-s", "--step", type=int, action="append", required=True, help="step to show, can be given more than once")
+    argparser.add_argument("-o", "--output", type=str, default=None, help="write the frames to this file instead of showing them, {step} in it is replaced by the step")
+    argparser.add_argument("--no-cache", action="store_true", help="always parse the image instead of reusing a cached parse")
+    add_parser_options(argparser)
+    args = argparser.parse_args(argv)
+
+    import cv2
+    from circles.cv_helper import display_and_wait
+    from circles.trace import TraceReplay
+
+    cache = None if args.no_cache else ProgramCache()
+    parser_options = get_parser_options(args)
+    program = load_program(args.path, parser_options, cache)
+
+    if program is None:
+        sys.exit(f"Couldn't parse {args.path}")
+
+    replay = TraceReplay(args.trace, program)
+    print(f"Trace has steps {replay.first_step} to {replay.last_step}", file=sys.stderr)
+
+    for step in args.step:
+        frame = replay.render(step)
+        if args.output is not None:
+            cv2.imwrite(args.output.format(step=step), frame)
+        else:
+            display_and_wait(frame, f"step {step}")
+
+def suite_main(argv=None):
+    argparser = argparse.ArgumentParser(prog="python -m circles suite", description="Run a program once for every line of inputs, all runs at once, and print how each one went as JSON")
+    argparser.add_argument("path", type=str, help="the program, an image or a .circb")
+    argparser.add_argument("inputs", type=str, help="file with the whitespace separated inputs of one run on every line")
+    argparser.add_argument("--max-steps", type=int, default=None, help="steps each run may take")
+    argparser.add_argument("--timeout", type=float, default=None, help="seconds all the runs may take together")
+    argparser.add_argument("--no-cache", action="store_true", help="always parse the image instead of reusing a cached parse")
+    add_parser_options(argparser)
+    args = argparser.parse_args(argv)
+
+    from circles.vector_interpreter import VectorInterpreter
+
+    cache = None if args.no_cache else ProgramCache()
+    program = load_program(args.path, get_parser_options(args), cache)
+
+    if program is None:
+        sys.exit(f"Couldn't parse {args.path}")
+
+    runs = [[int(token) for token in line.split()] for line in Path(args.inputs).read_text().splitlines()]
+    width = max(map(len, runs), default=0)
+    inputs = [run_inputs + [0]*(width - len(run_inputs)) for run_inputs in runs]
+
+    results = VectorInterpreter(program, inputs, [len(run_inputs) for run_inputs in runs]).run(args.max_steps, args.timeout)
+
+    for i, result in enumerate(results):
+        print(json.dumps({"run": i, **result}))
+
+def open_streams(args, stack:contextlib.ExitStack):
+    if args.input is not None:
+        reader = IntegerReader(stack.enter_context(open(args.input)))
+    elif args.no_prompt:
+        reader = IntegerReader(sys.stdin)
+    else:
+        reader = PromptReader()
+
+    if args.output is not None:
+        writer = IntegerWriter(stack.enter_context(open(args.output, "w")), BUFFER_SIZE)
+    elif args.no_prompt:
+        writer = IntegerWriter(sys.stdout, BUFFER_SIZE)
+    else:
+        writer = IntegerWriter()
+
+    return reader, writer
+
+def report_peak_memory():
+    peak = peak_memory()
+    if peak is not None:
+        print(f"Peak memory {peak/2**20:.1f} MiB", file=sys.stderr)
+
+def validate(program, headless:bool):
+    from circles.validator import validate_program
+
+    report = validate_program(program)
+    if report.ok:
+        print(f"No errors in {report.state_count} reachable states", file=sys.stderr)
+        return
+
+    if headless:
+        print(json.dumps(report.to_dict()), file=sys.stderr)
+    else:
+        for error in report.errors:
+            print(f"{type(error).__name__}: {error.message}", file=sys.stderr)
+            error.show_exception()
+    sys.exit(1)
+
+def run_program(args, profiler):
+    cache = None if args.no_cache else ProgramCache()
+    parser_options = get_parser_options(args)
+    parsed_program = load_program(args.path, parser_options, cache, profiler, args.parse_workers)
+
+    if args.low_memory:
+        report_peak_memory()
 
     if parsed_program is not None:
-        print(parsed_program.circles)
+        # Without prompts stdout only carries the outputs
+        print(list(parsed_program.circles), file=sys.stderr if args.no_prompt else sys.stdout)
 
         if args.vision:
+            from circles.cv_helper import display_and_wait
             display_and_wait(parsed_program.get_labeled_image())
 
-        interpreter = Interpreter(parsed_program, args.debug)
-        interpreter.run()
\ No newline at end of file
+        if args.validate:
+            validate(parsed_program, args.headless)
+
+        with contextlib.ExitStack() as stack:
+            reader, writer = open_streams(args, stack)
+            trace = None
+            if args.trace is not None:
+                from circles.trace import TraceRecorder
+                trace = TraceRecorder(args.trace_last)
+                stack.callback(trace.save, args.trace)
+
+            interpreter = Interpreter(parsed_program, args.debug, profiler, reader, writer, trace=trace, checked=not args.validate)
+            status = None
+            try:
+                status = interpreter.run(args.max_steps, args.timeout)
+            except HaltException as exception:
+                if not args.headless:
+                    exception.show_exception()
+                    raise
+            except CirclesException as exception:
+                if not args.headless:
+                    exception.show_exception()
+                    raise
+                print(json.dumps(exception.to_dict()), file=sys.stderr)
+                sys.exit(1)
+            except Exception as exception:
+                # Running out of input and anything else that goes wrong, in the shape batch reports it
+                if not args.headless:
+                    raise
+                print(json.dumps({"type": type(exception).__name__, "message": str(exception)}), file=sys.stderr)
+                sys.exit(1)
+
+            if status is not None:
+                print(f"Program stopped after {interpreter.step_number} steps ({status.name})", file=sys.stderr)
+                sys.exit(2)
@@ -1,197 +1,631 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+
 import cv2
 import numpy as np
 from scipy.spatial import KDTree
 
 from circles.program import CircleTypes, PathTypes, Circle, Path, Program
+from circles.profiling import NULL_PROFILER
 from circles.cv_helper import *
 
 class Parser:
-    def __init__(self, image) -> None:
+    def __init__(self, image, debug=False, profiler=NULL_PROFILER, pyramid_level=0, workers:int=None, adaptive=False, low_memory=False) -> None:
         self.image = image
+        self.debug = debug
+        self.profiler = profiler
+        # Threads the paths and circles are identified on, OpenCV lets go of the GIL while it works
+        self.workers = workers or os.cpu_count()
+        # Above 0, circles are looked for on the image downscaled 2**pyramid_level times and
+        # only measured at full resolution around what was found there
+        self.pyramid_level = pyramid_level
+        # Kernel sizes and Hough parameters follow the stroke width and circle sizes measured on the
+        # image instead of being fixed, so the parse doesn't depend on the resolution it was drawn at
+        self.adaptive = adaptive
+        self.stroke_width = self.STROKE_WIDTH
+        # Full frame arrays are written over in place where that parses the same, and let go of
+        # after the last stage that needs them, see RELEASED_AFTER
+        self.low_memory = low_memory
+        self.hough_parameters = {"max_radius": int(np.min(image.shape[:2]))}
         self.program = None
 
+        self.circles_debug = None
+        self.id_debug = None
+
+    FONT_SCALE = 0.7
+
+    # Stroke width the fixed kernel sizes were chosen for, the votes an adaptive Hough needs for a
+    # circle drawn with it and the fewest it needs however thin the strokes
+    STROKE_WIDTH = 6
+    HOUGH_VOTES = 30
+    HOUGH_MIN_VOTES = 10
+
+    STAGES = ("threshold", "distance_transform", "hough", "find_circles", "find_paths", "identify_circles")
+
+    # What no later stage reads, dropped after each stage when parsing with low_memory
+    RELEASED_AFTER = {
+        "find_circles": ("foreground_dist_trans", "dist_trans_rois", "hough_circles", "hough_kdtree"),
+        "find_paths": ("foreground", "stroke", "paths_mask", "circle_interior_labels", "circle_interior_stats", "unstroked_labels", "unstroked_stats", "interior_circles", "interior_starts"),
+        "identify_circles": ("fill", "circles_mask", "circles_kdtree"),
+    }
+
     def parse(self):
-        # TODO: Make this function not smell
-        FONT_SCALE = 0.7
+        for stage in self.STAGES:
+            with self.profiler.span(stage, "parse"):
+                getattr(self, stage)()
+
+            if self.low_memory:
+                for name in self.RELEASED_AFTER.get(stage, ()):
+                    setattr(self, name, None)
+
+        self.program = Program(self.image, self.circles, self.paths)
+        return self.program
 
-        # Initialization
-        self.gray = cv2.cvtColor(self.image, cv2.COLOR_RGB2GRAY)
-        self.gray_invert = cv2.bitwise_not(self.gray)
+    def threshold(self):
+        # Images read in grayscale are used as they are
+        self.gray = self.image if self.image.ndim == 2 else cv2.cvtColor(self.image, cv2.COLOR_RGB2GRAY)
 
-        _, self.stroke = cv2.threshold(self.gray_invert, 150, 255, cv2.THRESH_BINARY)
+        # Darker than 105 is more than 150 in the inverted image, without making the inverted image
+        _, self.stroke = cv2.threshold(self.gray, 104, 255, cv2.THRESH_BINARY_INV)
 
         _, self.fill = cv2.threshold(self.gray, 150, 255, cv2.THRESH_BINARY)
 
-        self.fill_contours, _ = find_contours(self.fill)
+        if self.adaptive:
+            self.stroke_width = self.estimate_stroke_width()
+
+        if not self.low_memory:
+            # Only the debug parsers look at these
+            self.fill_contours, _ = find_contours(self.fill)
 
         fill_or_stroke = cv2.bitwise_or(self.fill, self.stroke)
 
-        self.foreground = morph(fill_or_stroke, 3, cv2.MORPH_CLOSE) 
+        self.foreground = morph(fill_or_stroke, self.kernel_size(3), cv2.MORPH_CLOSE, dst=fill_or_stroke)
+
+    def estimate_stroke_width(self):
+        # Twice the median distance to the edge along the middle of the strokes
+        stroke_dist_trans = distance_transform(self.stroke)
+        ridge = cv2.compare(stroke_dist_trans, cv2.dilate(stroke_dist_trans, np.ones((3, 3), np.uint8)), cv2.CMP_GE)
+        ridge_dist_trans = stroke_dist_trans[cv2.bitwise_and(ridge, self.stroke) > 0]
+
+        if len(ridge_dist_trans) == 0:
+            return self.STROKE_WIDTH
+        # A stroke covering the whole image has no edge to measure to
+        return min(float(np.median(ridge_dist_trans))*2, float(np.min(self.stroke.shape[:2])))
+
+    def kernel_size(self, size:int):
+        # Grown with thicker strokes but never shrunk, below the fixed sizes they stop covering the
+        # antialiased edges, which are as wide at any resolution. Grown to the nearest size that
+        # stays odd or even, an even kernel has no middle pixel and puts what it finds half a pixel
+        # off where the fixed odd kernel doesn't
+        grown = size + 2*round((size*self.stroke_width/self.STROKE_WIDTH - size)/2)
+        return max(grown, size)
+
+    def distance_transform(self):
+        if self.pyramid_level > 0:
+            return self.coarse_distance_transform()
 
         self.foreground_dist_trans = distance_transform(self.foreground)
 
-        # Find circles
-        self.foreground_dist_trans_norm = self.foreground_dist_trans/np.max(self.foreground_dist_trans)
-        ret,self.foreground_dist_trans_norm_thresh = cv2.threshold(self.foreground_dist_trans_norm,0.5,1,cv2.THRESH_BINARY)
+        # Above half the maximum, compared straight away instead of on a normalized float64 copy
+        self.foreground_dist_trans_thresh = cv2.compare(self.foreground_dist_trans, float(np.max(self.foreground_dist_trans))/2, cv2.CMP_GT)
 
-        potential_circle_contours, _ = find_contours(np.array(self.foreground_dist_trans_norm_thresh, dtype=self.fill.dtype),)
+        self.potential_circle_contours, _ = find_contours(self.foreground_dist_trans_thresh)
+        if self.low_memory:
+            self.foreground_dist_trans_thresh = None
 
-        self.circles_debug = self.image.copy()
+        # Distance transforms the potential circles were found in, with the offset of each
+        self.dist_trans_rois = [(0, 0, self.foreground_dist_trans)]
+        self.potential_circle_rois = [0]*len(self.potential_circle_contours)
 
-        hough_circles = get_hough_circles(self.stroke)
+    def coarse_distance_transform(self):
+        scale = 2**self.pyramid_level
+        shape = self.foreground.shape
 
-        circle_positions=hough_circles[:,:2]
+        small_foreground = cv2.resize(self.foreground, None, fx=1/scale, fy=1/scale, interpolation=cv2.INTER_AREA)
+        _, small_foreground = cv2.threshold(small_foreground, 127, 255, cv2.THRESH_BINARY)
+        small_dist_trans = distance_transform(small_foreground)
 
-        circle_pos_kdtree = KDTree(circle_positions)
+        # Everything that could be above half the full resolution maximum is a candidate,
+        # with some slack for what downscaling moved around
+        estimated_max = float(np.max(small_dist_trans))*scale
+        slack = 2*scale + 2
+        candidates = np.array(small_dist_trans*scale >= estimated_max/2 - slack, np.uint8)
+        candidate_count, _, candidate_stats, _ = cv2.connectedComponentsWithStats(candidates)
+
+        boxes = [
+            (x*scale - slack, y*scale - slack, (x+w)*scale + slack, (y+h)*scale + slack)
+            for x, y, w, h, _ in candidate_stats[1:candidate_count]
+        ]
+
+        # Distances are only exact where the nearest background is inside the cropped foreground
+        pad = int(estimated_max) + slack + 2
+
+        while True:
+            boxes = merge_boxes([clip_box(box, shape) for box in boxes])
+
+            self.dist_trans_rois = []
+            for x0, y0, x1, y1 in boxes:
+                cx0, cy0, cx1, cy1 = clip_box((x0-pad, y0-pad, x1+pad, y1+pad), shape)
+                self.dist_trans_rois.append((cx0, cy0, distance_transform(self.foreground[cy0:cy1, cx0:cx1])))
+
+            max_dist_trans = max(
+                np.max(dist_trans[y0-cy0:y1-cy0, x0-cx0:x1-cx0])
+                for (x0, y0, x1, y1), (cx0, cy0, dist_trans) in zip(boxes, self.dist_trans_rois)
+            )
+
+            contours = []
+            grown_boxes = []
+            for i, ((x0, y0, x1, y1), (cx0, cy0, dist_trans)) in enumerate(zip(boxes, self.dist_trans_rois)):
+                box_dist_trans_norm = dist_trans[y0-cy0:y1-cy0, x0-cx0:x1-cx0]/max_dist_trans
+                _, box_thresh = cv2.threshold(box_dist_trans_norm,0.5,1,cv2.THRESH_BINARY)
+                box_thresh = np.array(box_thresh, dtype=self.fill.dtype)
+
+                # A circle cut off by the box would come out wrong, look again with a bigger box
+                if touches_inner_border(box_thresh, (x0, y0, x1, y1), shape):
+                    grown_boxes.append((x0-slack, y0-slack, x1+slack, y1+slack))
+                    continue
+                grown_boxes.append((x0, y0, x1, y1))
+
+                box_contours, _ = find_contours(box_thresh, offset=(x0, y0))
+                contours += [(box_contour, i) for box_contour in box_contours]
+
+            if grown_boxes == boxes:
+                break
+            boxes = grown_boxes
+
+        # Same order as a full resolution findContours, backwards through where each contour starts
+        contours.sort(key=lambda contour: (contour[0][0][0][1], contour[0][0][0][0]), reverse=True)
+
+        self.potential_circle_contours = [contour for contour, _ in contours]
+        self.potential_circle_rois = [roi for _, roi in contours]
+
+    def hough(self):
+        if self.adaptive:
+            self.estimate_hough_parameters()
+
+        if self.pyramid_level > 0:
+            self.candidate_hough()
+        else:
+            self.hough_circles = get_hough_circles(self.stroke, **self.hough_parameters)
+
+        self.hough_kdtree = KDTree(self.hough_circles[:,:2])
+
+    def candidate_hough(self):
+        # Hough circles are only used to confirm potential circles, so they are only looked for
+        # in a window around each potential circle instead of over the whole image
+        hough_circles = [
+            window_circles
+            for candidate_circles in self.map(self.candidate_hough_circles, list(zip(self.potential_circle_contours, self.potential_circle_rois)))
+            for window_circles in candidate_circles
+        ]
+
+        self.hough_circles = np.concatenate(hough_circles) if hough_circles else None
+
+    def candidate_hough_circles(self, candidate):
+        # What Hough finds depends on what is around it, so a window that confirms nothing is grown
+        # until it covers the image
+        pcc, roi = candidate
+        shape = self.stroke.shape
+        whole_image = (0, 0, shape[1], shape[0])
+        hough_circles = []
+
+        max_x, max_y, max_pcc_fdt = self.find_circle_peak(pcc, *self.dist_trans_rois[roi])
+        window_radius = int(max_pcc_fdt*2)
+
+        while True:
+            x0, y0, x1, y1 = circle_roi((max_x, max_y), window_radius, 2, shape)
+            window_circles = get_hough_circles(self.stroke[y0:y1, x0:x1], **self.hough_parameters)
+
+            if window_circles is not None:
+                window_circles = window_circles + (x0, y0, 0)
+                hough_circles.append(window_circles)
+                if np.min(np.hypot(window_circles[:,0]-max_x, window_circles[:,1]-max_y)) < max_pcc_fdt:
+                    return hough_circles
+
+            if (x0, y0, x1, y1) == whole_image:
+                return hough_circles
+            window_radius *= 2
+
+    def estimate_hough_parameters(self):
+        # Only radii around those of the potential circles are voted for, and centers closer than
+        # the smallest of them can't be two circles
+        radii = [
+            self.find_circle_peak(pcc, *self.dist_trans_rois[roi])[2]
+            for pcc, roi in zip(self.potential_circle_contours, self.potential_circle_rois)
+        ]
+        if not radii:
+            return
+
+        # Nothing is bigger than the image, the distance to the edge of a stroke that fills all of it
+        # is huge and doesn't fit in the ints HoughCircles takes
+        image_size = int(np.min(self.stroke.shape[:2]))
+        min_radius = min(float(np.min(radii)), image_size)
+        max_radius = min(float(np.max(radii)), image_size)
+        # Accumulator cells and the votes a circle needs grow with the stroke, a circle drawn twice
+        # as big gets twice the votes spread over twice the distance
+        scale = self.stroke_width/self.STROKE_WIDTH
+
+        self.hough_parameters = {
+            "min_dist": max(int(min_radius), 1),
+            "min_radius": int(min_radius/2),
+            "max_radius": min(int(max_radius*1.25 + self.stroke_width) + 2, image_size),
+            "param2": max(int(self.HOUGH_VOTES*scale), self.HOUGH_MIN_VOTES),
+            "dp": max(scale, 1),
+        }
+
+    def find_circles(self):
+        if self.debug:
+            self.circles_debug = self.image.copy()
 
         self.circles_mask = np.zeros_like(self.gray)
 
         self.confirmed_circles = []
 
-        for i, pcc in enumerate(potential_circle_contours):
-            pcc_mask = mask_contours([pcc], self.gray)
-            pcc_mask_fdt = self.foreground_dist_trans.copy()
-            pcc_mask_fdt[np.where(pcc_mask==0)]=0
-            max_pcc_fdt = np.max(pcc_mask_fdt)
+        with self.profiler.span("find_circles.contour_loop", "parse"):
+            for i, (pcc, roi) in enumerate(zip(self.potential_circle_contours, self.potential_circle_rois)):
+                max_x, max_y, max_pcc_fdt = self.find_circle_peak(pcc, *self.dist_trans_rois[roi])
 
-            where_max = list(zip(*np.where(pcc_mask_fdt==max_pcc_fdt)))
-            max_x = int(np.average([w[1] for w in where_max]))
-            max_y = int(np.average([w[0] for w in where_max]))
+                if self.confirms_circle(i, max_x, max_y, max_pcc_fdt):
+                    if self.debug:
+                        cv2.circle(self.circles_debug, (max_x, max_y), int(max_pcc_fdt), (255,0,0), -1)
+                    cv2.circle(self.circles_mask, (max_x, max_y), int(max_pcc_fdt), 255, -1)
 
-            query=circle_pos_kdtree.query((max_x, max_y))
+                    self.confirmed_circles.append((max_x, max_y, int(max_pcc_fdt)))
 
-            if query[0]<max_pcc_fdt:
-                cv2.circle(self.circles_debug, (max_x, max_y), int(max_pcc_fdt), (255,0,0), -1)
-                cv2.circle(self.circles_mask, (max_x, max_y), int(max_pcc_fdt), 255, -1)
+        self.profiler.count("parse.potential_circles", len(self.potential_circle_contours))
+        self.profiler.count("parse.circles", len(self.confirmed_circles))
 
-                self.confirmed_circles.append((max_x, max_y, int(max_pcc_fdt)))
-
-        circles_kdtree = KDTree(self.confirmed_circles)
+        self.circles_kdtree = KDTree(self.confirmed_circles)
 
         self.circles = [Circle(i, (int(c[0]), int(c[1])), int(c[2])) for i, c in enumerate(self.confirmed_circles)]
 
-        # Find and identify paths
-        self.paths_mask = morph(cv2.subtract(self.foreground, self.circles_mask), 6, cv2.MORPH_OPEN)
+    def confirms_circle(self, candidate:int, max_x:int, max_y:int, max_pcc_fdt):
+        # A potential circle is a circle when Hough found one close enough to its center
+        return self.hough_kdtree.query((max_x, max_y))[0] < max_pcc_fdt
+
+    def find_paths(self):
+        # The foreground isn't needed after this when parsing with low_memory
+        paths_mask = cv2.subtract(self.foreground, self.circles_mask, dst=self.foreground if self.low_memory else None)
+        self.paths_mask = morph(paths_mask, self.kernel_size(6), cv2.MORPH_OPEN, dst=paths_mask)
 
         path_contours, _ = find_contours(self.paths_mask)
+        if self.low_memory:
+            self.paths_mask = None
 
-        circles_grad = morph(self.circles_mask, 2, cv2.MORPH_GRADIENT)
+        circles_grad = morph(self.circles_mask, self.kernel_size(2), cv2.MORPH_GRADIENT)
 
-        fill_mask = self.stroke.copy()
-        fill_mask=np.pad(fill_mask, (1,1), 'constant', constant_values=255)
+        # Flood fills are replaced by lookups into 4-connected component labels, a fill from a seed
+        # covers exactly the component the seed is in.
+        with self.profiler.span("find_paths.label_regions", "parse"):
+            self.circle_interior_labels, self.circle_interior_stats = self.label_regions(cv2.bitwise_not(circles_grad, dst=circles_grad))
+            circles_grad = None
+            self.unstroked_labels, self.unstroked_stats = self.label_regions(cv2.bitwise_not(self.stroke))
+            self.interior_circles, self.interior_starts = self.index_circle_interiors()
 
-        self.id_debug = cv2.cvtColor(self.stroke//4, cv2.COLOR_GRAY2BGR)
+        # Regions already flood filled by an earlier path are masked off for the later ones
+        filled_unstroked_regions = set()
+
+        if self.debug:
+            self.id_debug = cv2.cvtColor(self.stroke//4, cv2.COLOR_GRAY2BGR)
 
         self.paths = []
 
         stroke_widths = []
 
-        for i, pc in enumerate(path_contours):
-            pc_mask = mask_contours([pc], self.gray)
-            pc_and_fill = cv2.bitwise_and(self.fill, pc_mask)
-            pc_and_stroke = cv2.bitwise_and(self.stroke, pc_mask)
+        with self.profiler.span("find_paths.path_loop", "parse"):
+            identified_paths = self.map(self.identify_path, path_contours)
 
-            pcas_distance_transform = distance_transform(pc_and_stroke)
-            max_pcasdt = np.max(pcas_distance_transform)
+            # Which path gets a region that several paths reach depends on the order of the paths,
+            # so that part is done one path after another
+            for i, (path_center, max_pcasdt, all_path_contours_count, center_regions, path_center_contours_count, connected_circles) in enumerate(identified_paths):
+                unfilled_center_regions = [region for region in center_regions if region not in filled_unstroked_regions]
+                filled_unstroked_regions.update(unfilled_center_regions)
 
-            stroke_widths.append(max_pcasdt)
-   
-            pcaf_contours, _ = find_contours(pc_and_fill)
-            pcafc_centroids = [get_contour_centroid(pcafc) for pcafc in pcaf_contours]
-            pcafcc_avg = np.average(pcafc_centroids, axis=0)
+                if unfilled_center_regions != center_regions:
+                    path_center_contours_count = self.regions_contours_count(self.unstroked_labels, self.unstroked_stats, unfilled_center_regions)
 
-            debuggery = self.image.copy()
-            cv2.circle(debuggery, (int(pcafcc_avg[0]), int(pcafcc_avg[1])), int(max_pcasdt*2), (255,0,0), -1)
+                path_type = PathTypes((all_path_contours_count - 2)*(int(path_center_contours_count!=all_path_contours_count)))
 
-            path_center_circ = np.zeros_like(self.gray)
-            cv2.circle(path_center_circ, (int(pcafcc_avg[0]), int(pcafcc_avg[1])), int(max_pcasdt*2), 255, -1)
+                stroke_widths.append(max_pcasdt)
 
-            path_center_circ_minus_stroke = cv2.subtract(path_center_circ, self.stroke)
-            pccms_contours, _ = find_contours(path_center_circ_minus_stroke)
+                self.paths.append(Path(i, path_type))
 
-            filled_path_center = np.zeros_like(self.gray)
+                if self.debug:
+                    cv2.putText(self.id_debug, path_type.name, path_center, cv2.FONT_HERSHEY_SIMPLEX, self.FONT_SCALE, (0,127,255), 2)
 
-            for pccmsc in pccms_contours:
-                pccmsc_centroid = get_contour_centroid(pccmsc)
-                cv2.floodFill(filled_path_center, fill_mask, pccmsc_centroid, 255)
-            
-            filled_path_center_contours, _ = find_contours(filled_path_center)
+                for circle_index in connected_circles:
+                    self.paths[i].connect_circle(self.circles[circle_index])
 
-            all_path_contours_count = len(pcaf_contours)
-            path_center_contours_count = len(filled_path_center_contours)
+        self.profiler.count("parse.paths", len(self.paths))
 
-            path_type_num = (all_path_contours_count - 2)*(int(path_center_contours_count!=all_path_contours_count))
+        self.max_stroke_width = int(np.max(stroke_widths))
 
-            self.paths.append(Path(i, PathTypes(path_type_num)))
+    def label_regions(self, image):
+        # With low_memory the labels are 16 bit unless there are too many regions for that, which
+        # OpenCV refuses instead of overflowing
+        if self.low_memory:
+            try:
+                _, labels, stats, _ = cv2.connectedComponentsWithStats(image, connectivity=4, ltype=cv2.CV_16U)
+                return labels, stats
+            except cv2.error:
+                pass
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(image, connectivity=4)
+        return labels, stats
 
-            cv2.putText(self.id_debug, PathTypes(path_type_num).name, (int(pcafcc_avg[0]), int(pcafcc_avg[1])), cv2.FONT_HERSHEY_SIMPLEX, FONT_SCALE, (0,127,255), 2)
+    def index_circle_interiors(self):
+        # The circle each circle interior region belongs to, and the pixel findContours would start
+        # its outline at, the leftmost one of its top row
+        labels = self.circle_interior_labels
+        region_circles = {}
+        for circle in self.circles:
+            region = labels[circle.center[1], circle.center[0]]
+            region_circles.setdefault(region, []).append(circle.index)
+
+        interior_circles = {}
+        interior_starts = {}
+        for region, circle_indices in region_circles.items():
+            # The background and interiors of overlapping circles aren't one circle
+            if region == 0 or len(circle_indices) != 1:
+                continue
+            x, y, w, _, _ = self.circle_interior_stats[region]
+            interior_circles[region] = circle_indices[0]
+            interior_starts[region] = (y, x + int(np.argmax(labels[y, x:x+w] == region)))
+
+        return interior_circles, interior_starts
+
+    def identify_circles(self):
+        circle_types = self.map(lambda circle: self.identify_circle(circle, self.max_stroke_width), self.circles)
+
+        for circle, circle_type in zip(self.circles, circle_types):
+            circle.type = circle_type
 
-            pc_mask_dilate = morph_func(pc_mask, cv2.dilate, int(max_pcasdt*2))
-            pcmd_and_circles = cv2.bitwise_and(pc_mask_dilate, self.circles_mask)
-            pcmdac_contours, _ = find_contours(pcmd_and_circles)
+            if self.debug:
+                cv2.putText(self.id_debug, circle.type.name, circle.center, cv2.FONT_HERSHEY_SIMPLEX, self.FONT_SCALE, (255,127,0), 2)
 
-            filled_circles_grad = circles_grad.copy()
+    def map(self, function, items):
+        # Results come back in the order of the items whatever order they finish in
+        if self.workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
 
-            for pcmdacc in pcmdac_contours:
-                pcmdacc_centroid = get_contour_centroid(pcmdacc)
-                cv2.floodFill(filled_circles_grad, None, pcmdacc_centroid, 255)
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+            return list(executor.map(function, items))
 
-            just_filled_circles = cv2.subtract(filled_circles_grad,circles_grad)
+    def find_circle_peak(self, pcc, fdt_x0, fdt_y0, fdt):
+        x0, y0, x1, y1 = contour_roi(pcc, 2, self.gray.shape)
 
-            jfc_contours, _ = find_contours(just_filled_circles)
+        pcc_mask = mask_contours([pcc], self.gray[y0:y1, x0:x1], offset=(-x0, -y0))
+        pcc_mask_fdt = fdt[y0-fdt_y0:y1-fdt_y0, x0-fdt_x0:x1-fdt_x0].copy()
+        pcc_mask_fdt[pcc_mask==0]=0
+        max_pcc_fdt = np.max(pcc_mask_fdt)
+
+        where_max_y, where_max_x = np.where(pcc_mask_fdt==max_pcc_fdt)
+        max_x = int(np.average(where_max_x + x0))
+        max_y = int(np.average(where_max_y + y0))
+
+        return max_x, max_y, max_pcc_fdt
+
+    @staticmethod
+    def seed_regions(labels, seeds):
+        regions = []
+        for x, y in seeds:
+            region = labels[y, x]
+            if region != 0 and region not in regions:
+                regions.append(region)
+        return regions
 
-            for jfcc in jfc_contours:
+    @staticmethod
+    def region_contours(labels, stats, regions):
+        x0, y0, x1, y1 = union_roi([roi_around(*stats[r][:4], 1, labels.shape) for r in regions])
+        regions_mask = np.isin(labels[y0:y1, x0:x1], regions).astype(np.uint8)*255
+        return find_contours(regions_mask, offset=(x0, y0))[0]
+
+    @classmethod
+    def regions_contours_count(cls, labels, stats, regions):
+        if not regions:
+            return 0
+        return len(cls.region_contours(labels, stats, regions))
+
+    def identify_path(self, pc):
+        shape = self.gray.shape
+
+        x0, y0, x1, y1 = contour_roi(pc, 2, shape)
+        pc_mask = mask_contours([pc], self.gray[y0:y1, x0:x1], offset=(-x0, -y0))
+        pc_and_fill = cv2.bitwise_and(self.fill[y0:y1, x0:x1], pc_mask)
+        pc_and_stroke = cv2.bitwise_and(self.stroke[y0:y1, x0:x1], pc_mask)
+
+        pcas_distance_transform = distance_transform(pc_and_stroke)
+        max_pcasdt = np.max(pcas_distance_transform)
+
+        pcaf_contours, _ = find_contours(pc_and_fill, offset=(x0, y0))
+        pcafc_centroids = [get_contour_centroid(pcafc) for pcafc in pcaf_contours]
+        pcafcc_avg = np.average(pcafc_centroids, axis=0)
+        path_center = (int(pcafcc_avg[0]), int(pcafcc_avg[1]))
+
+        # Type from how many of the regions inside the path are reachable from its center
+        center_radius = int(max_pcasdt*2)
+        cx0, cy0, cx1, cy1 = circle_roi(path_center, center_radius, 1, shape)
+        path_center_circ = np.zeros((cy1-cy0, cx1-cx0), np.uint8)
+        cv2.circle(path_center_circ, (path_center[0]-cx0, path_center[1]-cy0), center_radius, 255, -1)
+
+        path_center_circ_minus_stroke = cv2.subtract(path_center_circ, self.stroke[cy0:cy1, cx0:cx1])
+        pccms_contours, _ = find_contours(path_center_circ_minus_stroke, offset=(cx0, cy0))
+
+        # Counted as if no other path had filled any of these regions, find_paths counts again
+        # for the paths where one did
+        center_regions = self.seed_regions(self.unstroked_labels, [get_contour_centroid(pccmsc) for pccmsc in pccms_contours])
+        path_center_contours_count = self.regions_contours_count(self.unstroked_labels, self.unstroked_stats, center_regions)
+
+        all_path_contours_count = len(pcaf_contours)
+
+        # Connected circles from the circle interiors the slightly grown path reaches into
+        kernel_size = int(max_pcasdt*2)
+        dx0, dy0, dx1, dy1 = contour_roi(pc, kernel_size+2, shape)
+        pc_mask_dilate = morph_func(mask_contours([pc], self.gray[dy0:dy1, dx0:dx1], offset=(-dx0, -dy0)), cv2.dilate, kernel_size)
+        pcmd_and_circles = cv2.bitwise_and(pc_mask_dilate, self.circles_mask[dy0:dy1, dx0:dx1])
+        pcmdac_contours, _ = find_contours(pcmd_and_circles, offset=(dx0, dy0))
+
+        circle_regions = self.seed_regions(self.circle_interior_labels, [get_contour_centroid(pcmdacc) for pcmdacc in pcmdac_contours])
+
+        connected_circles = []
+
+        if all(region in self.interior_circles for region in circle_regions):
+            # Straight from the index, in the order the outlines of the regions would be found in
+            circle_regions.sort(key=self.interior_starts.get, reverse=True)
+            connected_circles = [self.interior_circles[region] for region in circle_regions]
+        else:
+            for jfcc in self.region_contours(self.circle_interior_labels, self.circle_interior_stats, circle_regions):
                 jfcc_mec = cv2.minEnclosingCircle(jfcc)
-                
-                circle_query = circles_kdtree.query([jfcc_mec[0][0], jfcc_mec[0][1], jfcc_mec[1]])
 
-                self.paths[i].connect_circle(self.circles[circle_query[1]])
-        
-        max_stroke_width = int(np.max(stroke_widths))
+                circle_query = self.circles_kdtree.query([jfcc_mec[0][0], jfcc_mec[0][1], jfcc_mec[1]])
 
-        # Identify circles
-        for circle in self.circles:
-            circle_mask = np.zeros_like(self.gray)
-            cv2.circle(circle_mask, circle.center, circle.radius, 255, -1)
+                connected_circles.append(circle_query[1])
 
-            circle_fill = cv2.bitwise_and(cv2.bitwise_and(self.fill, circle_mask), self.circles_mask)
-            circle_fill = morph(circle_fill, 3, cv2.MORPH_OPEN)
-            
-            circle_center = np.zeros_like(self.gray)
-            cv2.circle(circle_center, circle.center, max_stroke_width*4, 255, -1)
-            circle_fill_and_center = cv2.bitwise_and(circle_fill, circle_center)
-            cfac_contours, _ = find_contours(circle_fill_and_center)
-            cfac_contours_count = len(cfac_contours)
-
-            cf_contours, _ = find_contours(circle_fill)
-            cf_contours_count = len(cf_contours)
-
-            paths_count = len(circle.paths)
-
-            if paths_count != 0:
-                if cfac_contours_count==0:
-                    circle.type = CircleTypes.OUTPUT
-                elif cfac_contours_count==1:
-                    if paths_count*2+1 == cf_contours_count:
-                        circle.type = CircleTypes.NORMAL
-                    elif paths_count*4+1 == cf_contours_count:
-                        circle.type = CircleTypes.START
-                elif cfac_contours_count==2:
-                    circle.type = CircleTypes.DECREMENT
-                elif cfac_contours_count==4:
-                    circle.type = CircleTypes.INCREMENT
-                else:
-                    circle.type = CircleTypes.UNDEFINED
-            else:
-                circle.type = CircleTypes.UNDEFINED
+        return path_center, max_pcasdt, all_path_contours_count, center_regions, path_center_contours_count, connected_circles
 
-            cv2.putText(self.id_debug, circle.type.name, circle.center, cv2.FONT_HERSHEY_SIMPLEX, FONT_SCALE, (255,127,0), 2)
+    def identify_circle(self, circle:Circle, max_stroke_width:int):
+        x0, y0, x1, y1 = circle_roi(circle.center, circle.radius, 4, self.gray.shape)
+        center = (circle.center[0]-x0, circle.center[1]-y0)
 
-        self.program = Program(self.image, self.circles, self.paths)
-        return self.program
+        circle_mask = np.zeros((y1-y0, x1-x0), np.uint8)
+        cv2.circle(circle_mask, center, circle.radius, 255, -1)
+
+        circle_fill = cv2.bitwise_and(cv2.bitwise_and(self.fill[y0:y1, x0:x1], circle_mask), self.circles_mask[y0:y1, x0:x1])
+        circle_fill = morph(circle_fill, self.kernel_size(3), cv2.MORPH_OPEN)
+
+        circle_center = np.zeros_like(circle_mask)
+        cv2.circle(circle_center, center, max_stroke_width*4, 255, -1)
+        circle_fill_and_center = cv2.bitwise_and(circle_fill, circle_center)
+        cfac_contours, _ = find_contours(circle_fill_and_center)
+        cfac_contours_count = len(cfac_contours)
+
+        cf_contours, _ = find_contours(circle_fill)
+        cf_contours_count = len(cf_contours)
+
+        paths_count = len(circle.paths)
+
+        if paths_count != 0:
+            if cfac_contours_count==0:
+                return CircleTypes.OUTPUT
+            elif cfac_contours_count==1:
+                if paths_count*2+1 == cf_contours_count:
+                    return CircleTypes.NORMAL
+                elif paths_count*4+1 == cf_contours_count:
+                    return CircleTypes.START
+            elif cfac_contours_count==2:
+                return CircleTypes.DECREMENT
+            elif cfac_contours_count==4:
+                return CircleTypes.INCREMENT
+
+        return CircleTypes.UNDEFINED
 
     
 
+class IncrementalParser(Parser):
+    # Parses an edited image of a program that was parsed before. The whole image passes are cheap
+    # and run again, but Hough is only run for potential circles near pixels that changed, the
+    # others are circles exactly when the previous program had them. Circles and paths that are
+    # still there keep their indices.
+    def __init__(self, previous:Program, image, **parser_options) -> None:
+        super().__init__(image, **parser_options)
+        self.previous = previous
+
+        # Only the image the previous program was parsed from, kept in memory. Programs from the
+        # cache or a .circb would read their image_path, which may already hold the edited image
+        previous_image = previous._image
+        if previous_image is None or previous_image.shape != image.shape:
+            # Nothing to compare with, everything is parsed again
+            self.changed_boxes = None
+        else:
+            difference = cv2.absdiff(previous_image, image)
+            changed = (difference if difference.ndim == 2 else np.any(difference, axis=2)).astype(np.uint8)
+            changed_count, _, changed_stats, _ = cv2.connectedComponentsWithStats(changed)
+            self.changed_boxes = [(x, y, x+w, y+h) for x, y, w, h, _ in changed_stats[1:changed_count]]
+
+        self.previous_circles = {(*circle.center, circle.radius): circle.index for circle in previous.circles}
+        self.previous_paths = {(path.type, tuple(circle.index for circle in path.circles)): path.index for path in previous.paths}
+
+    def parse(self):
+        if self.changed_boxes == []:
+            self.program = self.previous
+            return self.program
+        return super().parse()
+
+    def hough(self):
+        if self.changed_boxes is None:
+            return super().hough()
+
+        if self.adaptive:
+            self.estimate_hough_parameters()
+
+        confirmations = self.map(self.confirm_candidate, list(zip(self.potential_circle_contours, self.potential_circle_rois)))
+        self.candidate_confirmed = [confirmed for confirmed, _ in confirmations]
+        self.profiler.count("parse.hough_candidates", sum(looked for _, looked in confirmations))
+
+    def confirm_candidate(self, candidate):
+        # Whether the candidate is a circle, and whether Hough had to be run to know
+        pcc, roi = candidate
+        max_x, max_y, max_pcc_fdt = self.find_circle_peak(pcc, *self.dist_trans_rois[roi])
+
+        # The window candidate_hough_circles starts with, where anything that could change what
+        # Hough finds for this circle would be
+        window = circle_roi((max_x, max_y), int(max_pcc_fdt*2), 4, self.stroke.shape)
+        if not any(boxes_overlap(window, box) for box in self.changed_boxes):
+            return (max_x, max_y, int(max_pcc_fdt)) in self.previous_circles, False
+
+        confirmed = any(
+            np.min(np.hypot(window_circles[:,0]-max_x, window_circles[:,1]-max_y)) < max_pcc_fdt
+            for window_circles in self.candidate_hough_circles(candidate)
+        )
+        return confirmed, True
+
+    def confirms_circle(self, candidate:int, max_x:int, max_y:int, max_pcc_fdt):
+        if self.changed_boxes is None:
+            return super().confirms_circle(candidate, max_x, max_y, max_pcc_fdt)
+        return self.candidate_confirmed[candidate]
+
+    def find_circles(self):
+        super().find_circles()
+
+        order = self.keep_indices([self.previous_circles.get(circle) for circle in self.confirmed_circles])
+        self.confirmed_circles = [self.confirmed_circles[i] for i in order]
+        self.circles_kdtree = KDTree(self.confirmed_circles)
+        self.circles = [Circle(i, (int(c[0]), int(c[1])), int(c[2])) for i, c in enumerate(self.confirmed_circles)]
+
+    def find_paths(self):
+        super().find_paths()
+
+        # Paths only count as the same path when all of their circles are the same circles
+        kept_circles = set(i for i, circle in enumerate(self.confirmed_circles) if self.previous_circles.get(circle) == i)
+        previous_indices = [
+            self.previous_paths.get((path.type, tuple(circle.index for circle in path.circles)))
+            if all(circle.index in kept_circles for circle in path.circles) else None
+            for path in self.paths
+        ]
+
+        self.paths = [self.paths[i] for i in self.keep_indices(previous_indices)]
+        for i, path in enumerate(self.paths):
+            path.index = i
+        for circle in self.circles:
+            circle.paths.sort(key=lambda path: path.index)
+
+    @staticmethod
+    def keep_indices(previous_indices):
+        # Order of the items by new index, items keep their previous index where it is still in
+        # range and the others fill the gaps in the order they came in
+        count = len(previous_indices)
+        slots = [None]*count
+        rest = []
+        for i, previous_index in enumerate(previous_indices):
+            if previous_index is not None and previous_index < count and slots[previous_index] is None:
+                slots[previous_index] = i
+            else:
+                rest.append(i)
+
+        free_slots = [index for index, item in enumerate(slots) if item is None]
+        for index, item in zip(free_slots, rest):
+            slots[index] = item
+        return slots
+
 class DebugProgramParser(Parser):
     def __init__(self, program = 5):
         self.MAX_PROGRAM = 7
@@ -204,7 +638,7 @@ class DebugProgramParser(Parser):
         return f"images\program-{number}.png"
 
     def parse(self):
-        super().__init__(cv2.imread(self.get_program(self.program_number)))
+        super().__init__(cv2.imread(self.get_program(self.program_number)), debug=True)
         return super().parse()
 
     def loop(self):
@@ -268,7 +702,7 @@ class DebugParser(Parser):
         self.program_path = program_path
 
     def parse(self):
-        super().__init__(cv2.imread(self.get_program(self.program_path)))
+        super().__init__(cv2.imread(self.get_program(self.program_path)), debug=True)
         return super().parse()
 
     def loop(self):
@@ -0,0 +1,94 @@
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+def peak_memory():
+    # Most resident memory the process has had so far in bytes, None where that can't be asked
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux counts in kilobytes, macOS in bytes
+    return peak if sys.platform == "darwin" else peak*1024
+
+class Profiler:
+    enabled = True
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(float)
+
+    @contextlib.contextmanager
+    def span(self, name:str, category:str="circles"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, category, start - self.origin, time.perf_counter() - start, threading.get_ident()))
+
+    def count(self, name:str, amount:int=1):
+        self.counters[name] += amount
+
+    def add_time(self, name:str, seconds:float):
+        self.timers[name] += seconds
+
+    def span_totals(self):
+        totals = defaultdict(float)
+        for name, _, _, duration, _ in self.spans:
+            totals[name] += duration
+        return dict(totals)
+
+    def to_dict(self):
+        return {
+            "spans": [
+                {"name": name, "category": category, "start": start, "duration": duration}
+                for name, category, start, duration, _ in self.spans
+            ],
+            "span_totals": self.span_totals(),
+            "counters": dict(self.counters),
+            "timers": dict(self.timers),
+        }
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        events = [
+            {"name": name, "cat": category, "ph": "X", "ts": start*1e6, "dur": duration*1e6, "pid": pid, "tid": tid}
+            for name, category, start, duration, tid in self.spans
+        ]
+
+        end = max((start + duration for _, _, start, duration, _ in self.spans), default=0)
+        if self.counters:
+            events.append({"name": "counters", "ph": "C", "ts": end*1e6, "pid": pid, "tid": 0, "args": dict(self.counters)})
+        if self.timers:
+            events.append({"name": "timers (s)", "ph": "C", "ts": end*1e6, "pid": pid, "tid": 0, "args": dict(self.timers)})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path:str, format:str="json"):
+        data = self.to_chrome_trace() if format == "chrome" else self.to_dict()
+        with open(path, "w") as output:
+            json.dump(data, output, indent=1)
+
+class NullProfiler:
+    # Stands in for a Profiler when profiling is off, every hook does nothing
+    enabled = False
+
+    _null_span = contextlib.nullcontext()
+
+    def span(self, name:str, category:str="circles"):
+        return self._null_span
+
+    def count(self, name:str, amount:int=1):
+        pass
+
+    def add_time(self, name:str, seconds:float):
+        pass
+
+NULL_PROFILER = NullProfiler()
@@ -1,11 +1,9 @@
 from __future__ import annotations
+from array import array
 from enum import Enum, auto
-from typing import List
-import cv2
-import numpy as np
-
-
-from circles.cv_helper import put_text
+from typing import List, Tuple
+import struct
+import sys
 
 class CircleTypes(Enum):
     UNDEFINED = "???"
@@ -21,14 +19,27 @@ class PathTypes(Enum):
     CONDITIONAL_PRIORITY = 4
     INPUT = 2
 
+# Numbers the types are stored as in .circb files
+CIRCLE_TYPE_CODES = {circle_type: code for code, circle_type in enumerate(CircleTypes)}
+PATH_TYPE_CODES = {path_type: code for code, path_type in enumerate(PathTypes)}
+
+# .circb files are this header (magic, format version, circle count, path count, number of path
+# to circle connections) followed by little endian arrays: int32 centers as x, y pairs, int32
+# radii, int32 offsets into and the int32 circle indices of every path's circles, then one byte
+# per circle type and per path type. Bump the version whenever any of that changes.
+CIRCB_MAGIC = b"CIRCB"
+CIRCB_VERSION = 1
+CIRCB_HEADER = struct.Struct("<5sBxxIII")
+
 class Circle:
+    __slots__ = ("index", "center", "radius", "type", "paths")
+
     def __init__(self, index, center, radius):
         self.index = index
         self.center = center
         self.radius = radius
         self.type = CircleTypes.UNDEFINED
         self.paths:List[Path] = []
-        self.value:int = 0
 
     def __repr__(self) -> str:
         return f"{self.type.name} Circle {self.index} <- {[p.index for p in self.paths]}"
@@ -37,13 +48,10 @@ class Circle:
         self.paths.append(path)
 
     def paths_that_dont_connect_to(self, circle:Circle):
-        paths:List[Path] = []
-        for p in self.paths:
-            if p.connected_circle_that_is_not(self).index != circle.index:
-                paths.append(p)
-        return paths
+        return [p for p in self.paths if p.connected_circle_that_is_not(self).index != circle.index]
 
     def draw(self, image, color=(0, 0, 255), thickness=2):
+        import cv2
         cv2.circle(image, self.center, self.radius, color, thickness)
 
 class Path:
@@ -54,10 +62,15 @@ class Path:
         PathTypes.INPUT: 0
     }
 
+    __slots__ = ("index", "type", "circles", "ends")
+
     def __init__(self, index, type:PathTypes):
         self.index = index
         self.type = type
         self.circles:List[Circle] = []
+        # The first circle and the first one after it that isn't the same circle, which is all
+        # connected_circle_that_is_not ever needs to look at
+        self.ends:Tuple[Circle, Circle] = (None, None)
 
     def __repr__(self) -> str:
         return f"{self.type.name} Path {self.index} -> {self.circles}"
@@ -66,31 +79,159 @@ class Path:
         self.circles.append(circle)
         circle.connect_path(self)
 
+        first, second = self.ends
+        if first is None:
+            self.ends = (circle, None)
+        elif second is None and circle.index != first.index:
+            self.ends = (first, circle)
+
     def connected_circle_that_is_not(self, circle:Circle):
-        for c in self.circles:
-            if c.index != circle.index:
-                return c
+        first, second = self.ends
+        if first is not None and first.index != circle.index:
+            return first
+        return second
 
-    def get_priority(self, current_circle:Circle):
+    def priority_for_value(self, value:int):
         if self.type == PathTypes.CONDITIONAL_PRIORITY:
-            if current_circle.value < 1:
+            if value < 1:
                 return 0
             else:
                 return self.PRIORITIES[self.type]
         return Path.PRIORITIES[self.type]
 
     def draw(self, image, color=(0, 255, 0), thickness=2):
+        import cv2
         for i in range(len(self.circles)-1):
             cv2.line(image, self.circles[i].center, self.circles[i+1].center, color, thickness)
 
 class Program:
-    def __init__(self, image, circles:List[Circle], paths:List[Path]):
-        self.image = image
-        self.circles = circles
-        self.paths = paths
+    __slots__ = ("_image", "image_path", "circles", "paths", "compiled")
+
+    def __init__(self, image, circles:List[Circle], paths:List[Path], image_path:str=None):
+        self._image = image
+        self.image_path = image_path
+
+        # The topology is frozen once it is a program, so any number of interpreters can run it at
+        # once. What changes while running lives in each interpreter.
+        self.circles = tuple(circles)
+        self.paths = tuple(paths)
+        for circle in self.circles:
+            circle.paths = tuple(circle.paths)
+        for path in self.paths:
+            path.circles = tuple(path.circles)
+
+        self.compiled = None
+
+    @property
+    def image(self):
+        # Programs that didn't come from a parse only read their image once something draws it
+        if self._image is None and self.image_path is not None:
+            import cv2
+            self._image = cv2.imread(self.image_path)
+        return self._image
+
+    def to_dict(self):
+        return {
+            "circles": [[circle.center[0], circle.center[1], circle.radius, circle.type.name] for circle in self.circles],
+            "paths": [[path.type.name, [circle.index for circle in path.circles]] for path in self.paths],
+        }
+
+    @classmethod
+    def from_dict(cls, data, image=None, image_path:str=None):
+        circles:List[Circle] = []
+        for i, (x, y, radius, type_name) in enumerate(data["circles"]):
+            circle = Circle(i, (x, y), radius)
+            circle.type = CircleTypes[type_name]
+            circles.append(circle)
+
+        paths:List[Path] = []
+        for i, (type_name, circle_indices) in enumerate(data["paths"]):
+            path = Path(i, PathTypes[type_name])
+            for circle_index in circle_indices:
+                path.connect_circle(circles[circle_index])
+            paths.append(path)
+
+        return cls(image, circles, paths, image_path)
+
+    def save(self, file_path:str):
+        centers = array("i", [coordinate for circle in self.circles for coordinate in circle.center])
+        radii = array("i", [circle.radius for circle in self.circles])
+        path_circle_offsets = array("i", [0])
+        path_circles = array("i")
+        for path in self.paths:
+            path_circles.extend(circle.index for circle in path.circles)
+            path_circle_offsets.append(len(path_circles))
+        types = array("B", [CIRCLE_TYPE_CODES[circle.type] for circle in self.circles])
+        path_types = array("B", [PATH_TYPE_CODES[path.type] for path in self.paths])
+
+        with open(file_path, "wb") as file:
+            file.write(CIRCB_HEADER.pack(CIRCB_MAGIC, CIRCB_VERSION, len(self.circles), len(self.paths), len(path_circles)))
+            for values in (centers, radii, path_circle_offsets, path_circles, types, path_types):
+                if sys.byteorder == "big":
+                    values.byteswap()
+                values.tofile(file)
+
+    @classmethod
+    def load(cls, file_path:str, image=None, image_path:str=None):
+        # The arrays are read with the stdlib array module, neither OpenCV nor NumPy is needed
+        with open(file_path, "rb") as file:
+            data = memoryview(file.read())
+
+        if len(data) < CIRCB_HEADER.size:
+            raise ValueError(f"{file_path} is not a .circb file")
+
+        magic, version, circle_count, path_count, path_circle_count = CIRCB_HEADER.unpack_from(data)
+        if magic != CIRCB_MAGIC:
+            raise ValueError(f"{file_path} is not a .circb file")
+        if version != CIRCB_VERSION:
+            raise ValueError(f"{file_path} is .circb version {version}, only version {CIRCB_VERSION} can be read")
+
+        offset = CIRCB_HEADER.size
+        sections = []
+        for typecode, count in (("i", circle_count*2), ("i", circle_count), ("i", path_count+1), ("i", path_circle_count), ("B", circle_count), ("B", path_count)):
+            values = array(typecode)
+            end = offset + values.itemsize*count
+            if end > len(data):
+                raise ValueError(f"{file_path} is cut off")
+            values.frombytes(data[offset:end])
+            if sys.byteorder == "big":
+                values.byteswap()
+            sections.append(values)
+            offset = end
+
+        centers, radii, path_circle_offsets, path_circles, types, path_types = (section.tolist() for section in sections)
+        circle_types = list(CircleTypes)
+        path_type_list = list(PathTypes)
+
+        circles:List[Circle] = []
+        for i, (x, y, radius, type_code) in enumerate(zip(centers[0::2], centers[1::2], radii, types)):
+            circle = Circle(i, (x, y), radius)
+            circle.type = circle_types[type_code]
+            circles.append(circle)
+
+        paths:List[Path] = []
+        for i, (type_code, start, end) in enumerate(zip(path_types, path_circle_offsets, path_circle_offsets[1:])):
+            path = Path(i, path_type_list[type_code])
+            for circle_index in path_circles[start:end]:
+                path.connect_circle(circles[circle_index])
+            paths.append(path)
+
+        return cls(image, circles, paths, image_path)
 
     def get_labeled_image(self, font_scale=0.7):
-        labeled = cv2.bitwise_not(self.image)//4
+        # Drawing is the only thing here that needs OpenCV, headless runs never import it
+        import cv2
+        import numpy as np
+        from circles.cv_helper import put_text
+
+        image = self.image
+        if image is None:
+            # Programs loaded without their image are labeled on a blank one that fits them
+            width = max((circle.center[0] + circle.radius for circle in self.circles), default=0) + 1
+            height = max((circle.center[1] + circle.radius for circle in self.circles), default=0) + 1
+            image = np.full((height, width, 3), 255, np.uint8)
+
+        labeled = cv2.bitwise_not(image)//4
 
         for path in self.paths:
             path_center = np.average(np.array([c.center for c in path.circles]), axis=0)
@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from circles.async_interpreter import AsyncInterpreter
+from circles.batch import warm_up
+from circles.cache import ProgramCache, default_cache_dir
+from circles.exceptions import CirclesException, HaltException
+from circles.interpreter import RunStatus
+from circles.program import Program
+
+# Parsed programs kept in memory, with their compiled tables
+DEFAULT_CACHE_SIZE = 128
+
+def default_socket_path():
+    return default_cache_dir() / "serve.sock"
+
+def parse_in_worker(image_bytes:bytes, parser_options:dict):
+    from circles.main import parse_image_bytes
+
+    # Requests already parse one per worker, more threads per parse would only fight over the cores
+    program = parse_image_bytes(image_bytes, parser_options, workers=1)
+    # Sent back without the image, the server never needs it
+    return None if program is None else program.to_dict()
+
+class ProgramServer:
+    # Answers one request per connection. A request is a line of JSON naming the program, then
+    # {"input": value} lines for as long as the client has inputs and {"end_of_input": true} once
+    # it has no more. Every output is sent back as an {"output": value} line as soon as it is
+    # written and the last line says how the run ended, with the fields batch reports. A line that
+    # is neither ends the run with an error, a client hanging up before the end stops the run.
+    def __init__(self, executor:ProcessPoolExecutor, cache:ProgramCache=None, cache_size:int=DEFAULT_CACHE_SIZE):
+        self.executor = executor
+        self.cache = cache
+        self.cache_size = cache_size
+
+        self.programs:OrderedDict[str, Program] = OrderedDict()
+        # Parses being waited on, so the same image sent twice at once is parsed once
+        self.parsing:dict = {}
+
+    async def load(self, path:str, parser_options:dict):
+        # Reading a big image or a slow disk would hold up every other connection
+        image_bytes = await asyncio.get_running_loop().run_in_executor(None, Path(path).read_bytes)
+        key = ProgramCache.key(image_bytes, parser_options)
+
+        if key in self.programs:
+            self.programs.move_to_end(key)
+            return self.programs[key], True
+
+        if key not in self.parsing:
+            self.parsing[key] = asyncio.ensure_future(self.parse(key, path, image_bytes, parser_options))
+        try:
+            program = await asyncio.shield(self.parsing[key])
+        finally:
+            self.parsing.pop(key, None)
+
+        if program is not None:
+            self.programs[key] = program
+            while len(self.programs) > self.cache_size:
+                self.programs.popitem(last=False)
+        return program, False
+
+    async def parse(self, key:str, path:str, image_bytes:bytes, parser_options:dict):
+        loop = asyncio.get_running_loop()
+        if Path(path).suffix == ".circb":
+            return await loop.run_in_executor(None, Program.load, path)
+
+        # The disk cache reads, writes and evicts files, off the event loop like the image reads
+        if self.cache is not None:
+            program = await loop.run_in_executor(None, self.cache.get, key, path)
+            if program is not None:
+                return program
+
+        data = await loop.run_in_executor(self.executor, parse_in_worker, image_bytes, parser_options)
+        if data is None:
+            return None
+
+        program = Program.from_dict(data, image_path=path)
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.put, key, program)
+        return program
+
+    async def handle(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            if line:
+                await self.answer(json.loads(line), reader, writer)
+        except (ConnectionError, json.JSONDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, request:dict, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        result = {
+            "status": "halted",
+            "halt_reason": None,
+            "error": None,
+            "steps": 0,
+            "cached": False,
+            "parse_time": None,
+            "run_time": None,
+        }
+
+        inputs = asyncio.Queue()
+        outputs = asyncio.Queue()
+        input_task = asyncio.ensure_future(self.read_inputs(reader, inputs))
+        output_task = asyncio.ensure_future(self.write_outputs(outputs, writer))
+        interpreter = None
+        stage_start = time.perf_counter()
+
+        try:
+            program, result["cached"] = await self.load(request["path"], request.get("parser_options") or {})
+            result["parse_time"] = time.perf_counter() - stage_start
+
+            if program is None:
+                raise ValueError(f"Couldn't parse {request['path']}")
+
+            stage_start = time.perf_counter()
+            interpreter = AsyncInterpreter(program, inputs, outputs)
+            run_task = asyncio.ensure_future(interpreter.run(request.get("max_steps"), request.get("timeout")))
+            await asyncio.wait((run_task, input_task), return_when=asyncio.FIRST_COMPLETED)
+            if not run_task.done():
+                run_task.cancel()
+                if input_task.exception() is not None and not isinstance(input_task.exception(), ConnectionError):
+                    # A line that isn't an input, the client is still there to be told
+                    raise input_task.exception()
+                # Otherwise reading only ends when the client hangs up, nobody is left to run the
+                # program for
+                output_task.cancel()
+                return
+            status = run_task.result()
+
+            if status == RunStatus.TIME_LIMIT:
+                result["status"] = "timeout"
+            elif status == RunStatus.STEP_LIMIT:
+                result["status"] = "step_limit"
+        except HaltException:
+            result["halt_reason"] = interpreter.halt_reason
+        except CirclesException as exception:
+            result["status"] = "error"
+            result["error"] = exception.to_dict()
+        except Exception as exception:
+            result["status"] = "error"
+            result["error"] = {"type": type(exception).__name__, "message": str(exception)}
+        finally:
+            input_task.cancel()
+            # Waited for so an input line it failed on is never left unretrieved
+            await asyncio.gather(input_task, return_exceptions=True)
+
+        if result["parse_time"] is None:
+            result["parse_time"] = time.perf_counter() - stage_start
+        else:
+            result["run_time"] = time.perf_counter() - stage_start
+
+        if interpreter is not None:
+            result["steps"] = interpreter.step_number
+
+        outputs.put_nowait(None)
+        await output_task
+        writer.write(json.dumps(result).encode() + b"\n")
+        await writer.drain()
+
+    @staticmethod
+    async def read_inputs(reader:asyncio.StreamReader, inputs:asyncio.Queue):
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                message = json.loads(line)
+                value = None if message.get("end_of_input") else int(message["input"])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError(f"Invalid input line {line.decode(errors='replace').strip()!r}") from None
+            inputs.put_nowait(value)
+
+    @staticmethod
+    async def write_outputs(outputs:asyncio.Queue, writer:asyncio.StreamWriter):
+        while True:
+            value = await outputs.get()
+            if value is None:
+                return
+            writer.write(json.dumps({"output": value}).encode() + b"\n")
+            await writer.drain()
+
+async def serve(args):
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=warm_up) as executor:
+        # Start every worker now so the first parses don't wait for the imports
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, warm_up) for _ in range(args.jobs)))
+
+        program_server = ProgramServer(executor, None if args.no_cache else ProgramCache(), args.cache_size)
+
+        if args.port is not None:
+            server = await asyncio.start_server(program_server.handle, "127.0.0.1", args.port)
+            print(f"Serving on 127.0.0.1:{args.port}", file=sys.stderr)
+        else:
+            socket_path = Path(args.socket)
+            socket_path.parent.mkdir(parents=True, exist_ok=True)
+            socket_path.unlink(missing_ok=True)
+            server = await asyncio.start_unix_server(program_server.handle, str(socket_path))
+            print(f"Serving on {socket_path}", file=sys.stderr)
+
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog="python -m circles serve", description="Keep parse workers and parsed programs around and run programs for python -m circles client")
+    argparser.add_argument("--socket", type=str, default=str(default_socket_path()), help="Unix socket to listen on")
+    argparser.add_argument("--port", type=int, default=None, help="listen on this port of localhost instead of a Unix socket")
+    argparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of parse worker processes")
+    argparser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="parsed programs to keep in memory")
+    argparser.add_argument("--no-cache", action="store_true", help="don't read or write the parse cache on disk, only keep programs in memory")
+    args = argparser.parse_args(argv)
+
+    if args.port is None and not hasattr(asyncio, "start_unix_server"):
+        argparser.error("Unix sockets aren't available here, use --port")
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,60 @@
+import sys
+
+# Values a writer holds on to when it isn't writing to a terminal someone is watching
+BUFFER_SIZE = 4096
+
+class PromptReader:
+    # Asks for every integer on the terminal, the interactive default
+    def __init__(self, prompt:str="Input an integer: "):
+        self.prompt = prompt
+
+    def read(self):
+        while True:
+            try:
+                return int(input(self.prompt))
+            except ValueError:
+                print("Invalid input", file=sys.stderr)
+
+class IntegerReader:
+    # Reads whitespace separated integers from a file or pipe without prompting, a line at a time
+    # so values piped in are used as soon as they arrive
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.tokens = []
+        self.position = 0
+
+    def read(self):
+        while True:
+            while self.position >= len(self.tokens):
+                line = (self.stream or sys.stdin).readline()
+                if not line:
+                    raise EOFError("No more input")
+                self.tokens = line.split()
+                self.position = 0
+
+            token = self.tokens[self.position]
+            self.position += 1
+            try:
+                return int(token)
+            except ValueError:
+                print("Invalid input", file=sys.stderr)
+
+class IntegerWriter:
+    # Writes one integer per line, holding on to buffer_size values before writing them at once.
+    # Without a stream it writes to whatever sys.stdout is when it flushes
+    def __init__(self, stream=None, buffer_size:int=1):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def write(self, value:int):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+        if self.buffer:
+            stream.write("\n".join(map(str, self.buffer)) + "\n")
+            self.buffer.clear()
+        stream.flush()
@@ -0,0 +1,175 @@
+from array import array
+from typing import List
+import struct
+import sys
+
+from circles.program import Program
+
+CIRCT_MAGIC = b"CIRCT"
+CIRCT_VERSION = 1
+# magic, version, circle count, step of the first record, record count
+CIRCT_HEADER = struct.Struct("<5sBxxIQQ")
+
+# Records between the values the replay keeps, a seek replays at most this many
+KEYFRAME_INTERVAL = 4096
+
+# Values and deltas are kept as 64 bit integers. A delta between two values that fit doesn't always
+# fit itself, but wrapped around it still adds up to the right value since the replay wraps too.
+VALUE_MIN = -2**63
+VALUE_MAX = 2**63 - 1
+
+def wrapped(value:int):
+    return (value - VALUE_MIN) % 2**64 + VALUE_MIN
+
+def check_value(circle:int, value:int):
+    if not VALUE_MIN <= value <= VALUE_MAX:
+        raise OverflowError(f"Values have to fit in 64 bits to be traced, circle {circle} has {value}")
+
+class TraceRecorder:
+    # Keeps one record per step, the circle the step was at, the path it took and how much the
+    # value of that circle changed. With a capacity only the last capacity steps are kept, and the
+    # ones that fall out are added to the values the trace starts from.
+    def __init__(self, capacity:int=None):
+        if capacity is not None and capacity < 1:
+            raise ValueError(f"A trace has to keep at least 1 step, not {capacity}")
+        self.capacity = capacity
+        self.first_step:int = None
+        self.start_values:List[int] = None
+
+        self.circles = array("i")
+        self.paths = array("i")
+        self.deltas = array("q")
+        # Where the oldest record is once a ring buffer is full
+        self.position = 0
+
+    def begin(self, step_number:int, values:List[int]):
+        for circle, value in enumerate(values):
+            check_value(circle, value)
+        self.first_step = step_number
+        self.start_values = list(values)
+
+    def record(self, circle:int, path:int, delta:int, value:int):
+        # value is what the circle has after the step
+        check_value(circle, value)
+        if not VALUE_MIN <= delta <= VALUE_MAX:
+            delta = wrapped(delta)
+
+        if self.capacity is None or len(self.circles) < self.capacity:
+            self.circles.append(circle)
+            self.paths.append(path)
+            self.deltas.append(delta)
+            return
+
+        position = self.position
+        start_circle = self.circles[position]
+        self.start_values[start_circle] = wrapped(self.start_values[start_circle] + self.deltas[position])
+        self.first_step += 1
+
+        self.circles[position] = circle
+        self.paths[position] = path
+        self.deltas[position] = delta
+        self.position = (position + 1) % self.capacity
+
+    def save(self, file_path:str):
+        position = self.position
+        start_values = array("q", self.start_values or [])
+        sections = [start_values] + [records[position:] + records[:position] for records in (self.circles, self.paths, self.deltas)]
+
+        with open(file_path, "wb") as file:
+            file.write(CIRCT_HEADER.pack(CIRCT_MAGIC, CIRCT_VERSION, len(start_values), self.first_step or 0, len(self.circles)))
+            for values in sections:
+                if sys.byteorder == "big":
+                    values.byteswap()
+                values.tofile(file)
+
+class TraceReplay:
+    # Reads a trace once, keeping the values every KEYFRAME_INTERVAL steps, so the values at any
+    # step are a keyframe plus at most that many records away
+    def __init__(self, file_path:str, program:Program):
+        import numpy as np
+
+        with open(file_path, "rb") as file:
+            data = file.read()
+
+        if len(data) < CIRCT_HEADER.size:
+            raise ValueError(f"{file_path} is not a trace")
+        magic, version, circle_count, first_step, record_count = CIRCT_HEADER.unpack_from(data)
+        if magic != CIRCT_MAGIC:
+            raise ValueError(f"{file_path} is not a trace")
+        if version != CIRCT_VERSION:
+            raise ValueError(f"{file_path} is trace version {version}, only version {CIRCT_VERSION} can be read")
+        if circle_count != len(program.circles):
+            raise ValueError(f"{file_path} is a trace of a program with {circle_count} circles, not {len(program.circles)}")
+
+        offset = CIRCT_HEADER.size
+        sections = []
+        for dtype, count in (("<i8", circle_count), ("<i4", record_count), ("<i4", record_count), ("<i8", record_count)):
+            end = offset + np.dtype(dtype).itemsize*count
+            if end > len(data):
+                raise ValueError(f"{file_path} is cut off")
+            sections.append(np.frombuffer(data, dtype, count, offset).astype(dtype[1:]))
+            offset = end
+
+        self.program = program
+        self.first_step = first_step
+        self.last_step = first_step + record_count
+        start_values, self.circles, self.paths, self.deltas = sections
+
+        self.keyframes = [start_values]
+        for start in range(0, record_count - KEYFRAME_INTERVAL + 1, KEYFRAME_INTERVAL):
+            self.keyframes.append(self.advance(self.keyframes[-1], start, start + KEYFRAME_INTERVAL))
+
+    def advance(self, values, start:int, end:int):
+        import numpy as np
+
+        values = values.copy()
+        np.add.at(values, self.circles[start:end], self.deltas[start:end])
+        return values
+
+    def record_index(self, step_number:int):
+        if not self.first_step <= step_number <= self.last_step:
+            raise IndexError(f"Step {step_number} is not in the trace, it has steps {self.first_step} to {self.last_step}")
+        return step_number - self.first_step
+
+    def values_at(self, step_number:int):
+        # The values before the step is taken
+        index = self.record_index(step_number)
+        keyframe = index//KEYFRAME_INTERVAL
+        return self.advance(self.keyframes[keyframe], keyframe*KEYFRAME_INTERVAL, index)
+
+    def circle_at(self, step_number:int):
+        index = self.record_index(step_number)
+        circles = self.program.circles
+        if index < len(self.circles):
+            return circles[self.circles[index]]
+        if index == 0:
+            raise IndexError("The trace is empty")
+        # Past the last record the program is at the far end of the last path taken
+        return self.program.paths[self.paths[index-1]].connected_circle_that_is_not(circles[self.circles[index-1]])
+
+    def path_at(self, step_number:int):
+        index = self.record_index(step_number)
+        if index < len(self.paths):
+            return self.program.paths[self.paths[index]]
+        return None
+
+    def render(self, step_number:int):
+        from circles.cv_helper import put_text
+
+        image = self.program.get_labeled_image()
+        values = self.values_at(step_number)
+
+        if step_number > self.first_step:
+            self.path_at(step_number - 1).draw(image, (255, 0, 255))
+        path = self.path_at(step_number)
+        if path is not None:
+            path.draw(image)
+        self.circle_at(step_number).draw(image, (0, 255, 0))
+
+        for circle, value in zip(self.program.circles, values.tolist()):
+            if value:
+                x, y = circle.center
+                put_text(image, str(value), (int(x), int(y) + 25), color=(255, 255, 255))
+
+        put_text(image, f"step {step_number}", (10, 30), color=(255, 255, 255))
+        return image
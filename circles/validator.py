@@ -0,0 +1,252 @@
+from typing import Dict, List, Set, Tuple
+
+from circles.program import CircleTypes, PathTypes, Program, Circle
+from circles.compiler import compile_program
+from circles.exceptions import *
+
+# Values and crement counts are followed as ranges of what they can be. Past this bound a range
+# only keeps which side of it it is on, so there are only so many of them and the walk ends.
+VALUE_BOUND = 8
+# Programs with more states than this, or more ranges across all of them, are only walked knowing
+# which circles are ever written
+MAX_VALUE_STATES = 200000
+MAX_VALUE_RANGES = 4000000
+
+ANY = (None, None)
+ZERO = (0, 0)
+
+def bounded(low, high):
+    if low is not None:
+        if low > VALUE_BOUND:
+            low = VALUE_BOUND
+        elif low < -VALUE_BOUND:
+            low = None
+    if high is not None:
+        if high > VALUE_BOUND:
+            high = None
+        elif high < -VALUE_BOUND:
+            high = -VALUE_BOUND
+    return (low, high)
+
+def add_ranges(first, second):
+    low = None if first[0] is None or second[0] is None else first[0] + second[0]
+    high = None if first[1] is None or second[1] is None else first[1] + second[1]
+    return bounded(low, high)
+
+def range_values(value_range):
+    # The values the paths are decided by (0 for below 1, 1 for 1 or more) the range can have,
+    # with the range narrowed to each of them
+    low, high = value_range
+    values = []
+    if low is None or low < 1:
+        values.append((0, (low, 0 if high is None else min(high, 0))))
+    if high is None or high >= 1:
+        values.append((1, (1 if low is None else max(low, 1), high)))
+    return values
+
+class ValidationReport:
+    def __init__(self, program:Program, errors:List[CirclesException], halts:List[HaltException], state_count:int):
+        self.program = program
+        # Everything that stops a run with an error, in the order the states were reached
+        self.errors = errors
+        # Where runs can halt, dead ends are how most programs end so these aren't errors
+        self.halts = halts
+        self.state_count = state_count
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def to_dict(self):
+        return {
+            "ok": self.ok,
+            "states": self.state_count,
+            "errors": [error.to_dict() for error in self.errors],
+            "halts": [halt.to_dict() for halt in self.halts],
+        }
+
+class ProgramValidator:
+    # Walks every state a run can reach without running it. A state is a compiled (previous, current)
+    # state plus whether a crementation is pending and by how much, whether an input is held, whether
+    # a normal circle has been visited and the range every value can be in. A range is narrowed by
+    # the way a circle is left, so a value that can only be 1 or more there is never taken as 0.
+    # Inputs can be anything. That walk only follows the circles a first walk that knows less finds
+    # written to, and is skipped for programs with too many states. The first walk only knows that a
+    # normal circle that is never written to stays 0 and takes any other normal circle both ways.
+    def __init__(self, program:Program):
+        self.program = program
+        self.compiled = compile_program(program)
+
+        self.errors:Dict[tuple, CirclesException] = {}
+        self.halts:Dict[tuple, HaltException] = {}
+        self.written:Set[int] = set()
+        self.state_count = 0
+
+    def validate(self):
+        start = self.check_circles()
+        if start is not None:
+            errors, halts = dict(self.errors), dict(self.halts)
+
+            # Writes found along the way can make more values 1 or more, so walk again until no
+            # new circle is written to
+            while True:
+                written = len(self.written)
+                self.walk(start)
+                if len(self.written) == written:
+                    break
+
+            walked = self.errors, self.halts, self.state_count
+            self.errors, self.halts = errors, halts
+            if not self.walk_values(start):
+                self.errors, self.halts, self.state_count = walked
+
+        return ValidationReport(self.program, list(self.errors.values()), list(self.halts.values()), self.state_count)
+
+    def add(self, found:Dict[tuple, CirclesException], exception:CirclesException):
+        key = (type(exception), tuple(circle.index for circle in exception.circles), tuple(path.index for path in exception.paths))
+        found.setdefault(key, exception)
+
+    def check_circles(self):
+        # What get_start_circle would raise, all of it instead of the first problem
+        starts = [circle for circle in self.program.circles if circle.type == CircleTypes.START]
+        undefined_circles = [circle for circle in self.program.circles if circle.type == CircleTypes.UNDEFINED]
+
+        if undefined_circles:
+            self.add(self.errors, UndefinedCircleException("Undefined circles found", self.program, undefined_circles))
+        if len(starts) == 0:
+            self.add(self.errors, StartCircleException("No start circle found", self.program, []))
+        elif len(starts) > 1:
+            self.add(self.errors, StartCircleException("Multiple start circles found", self.program, starts))
+
+        return starts[0] if len(starts) == 1 and not undefined_circles else None
+
+    def walk_values(self, start:Circle):
+        compiled = self.compiled
+        circles = self.program.circles
+
+        # Where the range of each circle that is ever written to is kept, all the others stay 0
+        slots = {circle: slot for slot, circle in enumerate(sorted(self.written))}
+        max_states = min(MAX_VALUE_STATES, MAX_VALUE_RANGES // max(len(slots), 1))
+
+        first = (compiled.state_index[(start.index, start.index)], False, ZERO, False, False, (ZERO,)*len(slots))
+        seen = {first}
+        pending = [first]
+
+        while pending:
+            if len(seen) > max_states:
+                return False
+
+            state, crementing, crement_count, holding_input, visited_normal, values = pending.pop()
+            previous = circles[compiled.state_previous[state]]
+            current = circles[compiled.state_current[state]]
+
+            if current.type == CircleTypes.START:
+                if state != first[0]:
+                    self.add(self.halts, StartReenteredException("Program halted because start circle reentered", self.program, [current]))
+                    continue
+            elif current.type == CircleTypes.NORMAL:
+                if current.index in slots:
+                    slot = slots[current.index]
+                    value = ANY if holding_input else values[slot]
+                    if crementing:
+                        value = add_ranges(value, crement_count)
+                    values = values[:slot] + (value,) + values[slot+1:]
+                crementing = holding_input = False
+                crement_count = ZERO
+                visited_normal = True
+            elif current.type == CircleTypes.INCREMENT:
+                crementing = True
+                crement_count = add_ranges(crement_count, (1, 1))
+            elif current.type == CircleTypes.DECREMENT:
+                crementing = True
+                crement_count = add_ranges(crement_count, (-1, -1))
+            elif current.type == CircleTypes.OUTPUT:
+                if not visited_normal:
+                    self.add(self.errors, NoNormalCircleVisitedException(self.program, current))
+                    continue
+                if crementing:
+                    self.add(self.errors, NoNormalCircleAfterCrementationException(self.program, [current, previous]))
+                    continue
+
+            slot = slots.get(current.index)
+            value_ranges = dict(range_values(ZERO if slot is None else values[slot]))
+            for next_state, input_path, value in self.next_states(previous, current, list(value_ranges)):
+                narrowed = values if slot is None else values[:slot] + (value_ranges[value],) + values[slot+1:]
+                reached = (next_state, crementing, crement_count, holding_input or input_path, visited_normal, narrowed)
+                if reached not in seen:
+                    seen.add(reached)
+                    pending.append(reached)
+
+        self.state_count = len(seen)
+        return True
+
+    def walk(self, start:Circle):
+        compiled = self.compiled
+        circles = self.program.circles
+
+        first = (compiled.state_index[(start.index, start.index)], False, False, False)
+        seen = {first}
+        pending = [first]
+
+        while pending:
+            state, crementing, holding_input, visited_normal = pending.pop()
+            previous = circles[compiled.state_previous[state]]
+            current = circles[compiled.state_current[state]]
+
+            if current.type == CircleTypes.START:
+                if state != first[0]:
+                    self.add(self.halts, StartReenteredException("Program halted because start circle reentered", self.program, [current]))
+                    continue
+            elif current.type == CircleTypes.NORMAL:
+                if crementing or holding_input:
+                    self.written.add(current.index)
+                crementing = holding_input = False
+                visited_normal = True
+            elif current.type in (CircleTypes.INCREMENT, CircleTypes.DECREMENT):
+                crementing = True
+            elif current.type == CircleTypes.OUTPUT:
+                if not visited_normal:
+                    self.add(self.errors, NoNormalCircleVisitedException(self.program, current))
+                    continue
+                if crementing:
+                    self.add(self.errors, NoNormalCircleAfterCrementationException(self.program, [current, previous]))
+                    continue
+
+            values = [0, 1] if current.index in self.written else [0]
+            for next_state, input_path, _ in self.next_states(previous, current, values):
+                reached = (next_state, crementing, holding_input or input_path, visited_normal)
+                if reached not in seen:
+                    seen.add(reached)
+                    pending.append(reached)
+
+        self.state_count = len(seen)
+
+    def next_states(self, previous:Circle, current:Circle, values:List[int]):
+        broken_paths = [path for path in current.paths if path.connected_circle_that_is_not(current) is None]
+        if broken_paths:
+            self.add(self.errors, BrokenPathException("Paths not connected to two circles", self.program, broken_paths))
+            return []
+
+        next_paths = current.paths_that_dont_connect_to(previous)
+        if len(next_paths) < 1:
+            self.add(self.halts, DeadEndException("Program halted because there are no possible paths without going back", self.program, [current]))
+            return []
+
+        next_states:List[Tuple[int, bool, int]] = []
+        for value in values:
+            priorities = [path.priority_for_value(value) for path in next_paths]
+            max_priority = max(priorities)
+            possible_next_paths = [path for path, priority in zip(next_paths, priorities) if priority == max_priority]
+
+            if len(possible_next_paths) > 1:
+                self.add(self.errors, AmbiguousPathsException("Too many possible paths", self.program, [current], possible_next_paths))
+                continue
+
+            path = possible_next_paths[0]
+            next_circle = path.connected_circle_that_is_not(current)
+            next_states.append((self.compiled.state_index[(current.index, next_circle.index)], path.type == PathTypes.INPUT, value))
+
+        return next_states
+
+def validate_program(program:Program):
+    return ProgramValidator(program).validate()
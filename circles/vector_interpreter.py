@@ -0,0 +1,288 @@
+import time
+
+import numpy as np
+
+from circles.program import Program
+from circles.interpreter import Interpreter, CrementModes, InputModes
+from circles.compiler import compile_program, OP_NORMAL, OP_INCREMENT, OP_DECREMENT, OP_OUTPUT, OP_START, OP_MACRO
+from circles.exceptions import CirclesException, HaltException
+
+# Lock-step iterations between looking at the clock
+TIME_CHECK_INTERVAL = 256
+
+class EmptyReader:
+    def read(self):
+        return None
+
+class NullWriter:
+    def write(self, value:int):
+        pass
+
+    def flush(self):
+        pass
+
+class VectorInterpreter:
+    # Runs one program on every row of an N×k array of inputs at once. Each run has its own state
+    # in the compiled tables, values and input position, and every step of the loop advances all
+    # runs that are still going, the ones at the same kind of circle with one array operation
+    # whatever state each of them is in. Values are 64-bit integers, unlike the interpreter's
+    # Python ints: inputs that don't fit in them raise OverflowError and values wrap around.
+    def __init__(self, program:Program, inputs, input_counts=None) -> None:
+        self.program = program
+        try:
+            self.inputs = np.asarray(inputs, dtype=np.int64)
+        except OverflowError:
+            raise OverflowError("Inputs have to fit in 64 bits to be run in lock step") from None
+        if self.inputs.ndim == 1:
+            # One input for each run
+            self.inputs = self.inputs[:, None]
+
+        run_count, input_width = self.inputs.shape
+        # How many of the inputs of each run are real, rows of different lengths are padded
+        self.input_counts = np.full(run_count, input_width, np.int64) if input_counts is None else np.asarray(input_counts, dtype=np.int64)
+
+        # Results of the object-level interpreter for the states that end runs, by what decided it
+        self.object_level_results = {}
+        # The values of every run once run is done, a row per run
+        self.values = None
+
+    def run(self, max_steps:int=None, timeout:float=None):
+        run_count = len(self.inputs)
+        results = [self.new_result() for _ in range(run_count)]
+        if run_count == 0:
+            return results
+
+        try:
+            start = Interpreter(self.program, reader=EmptyReader(), writer=NullWriter()).get_start_circle()
+        except CirclesException as exception:
+            for result in results:
+                self.set_exception(result, exception)
+            return results
+
+        compiled = compile_program(self.program)
+        circle_count = len(self.program.circles)
+
+        opcodes = np.array(compiled.opcodes, np.int8)
+        state_ops = np.array(compiled.state_ops, np.int8)
+        state_current = np.array(compiled.state_current, np.int64)
+        next_state = np.array(compiled.next_state, np.int64)
+        next_input = np.array(compiled.next_input, bool)
+
+        macro_normal = np.array(compiled.macro_normal, np.int64)
+        macro_last_normal = np.array(compiled.macro_last_normal, np.int64)
+        macro_crements = np.array(compiled.macro_crements, np.int64)
+        macro_delta = np.array(compiled.macro_delta, np.int64)
+        macro_target = np.array(compiled.macro_target, np.int64)
+        macro_steps = np.array(compiled.macro_steps, np.int64)
+
+        values = self.values = np.zeros((run_count, circle_count), np.int64)
+        states = np.full(run_count, compiled.state_index[(start.index, start.index)], np.int64)
+        steps = np.zeros(run_count, np.int64)
+        crementing = np.zeros(run_count, bool)
+        crement_counts = np.zeros(run_count, np.int64)
+        holding_input = np.zeros(run_count, bool)
+        input_values = np.zeros(run_count, np.int64)
+        input_positions = np.zeros(run_count, np.int64)
+        last_normal = np.full(run_count, -1, np.int64)
+
+        output_runs = []
+        output_values = []
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        limit_step = np.iinfo(np.int64).max if max_steps is None else max_steps
+
+        live = np.arange(run_count)
+        iteration = 0
+
+        while len(live):
+            iteration += 1
+            if deadline is not None and iteration % TIME_CHECK_INTERVAL == 0 and time.perf_counter() >= deadline:
+                for run in live.tolist():
+                    results[run]["status"] = "timeout"
+                break
+
+            limited = steps[live] >= limit_step
+            if limited.any():
+                for run in live[limited].tolist():
+                    results[run]["status"] = "step_limit"
+                live = live[~limited]
+                if not len(live):
+                    break
+
+            run_states = states[live]
+            current = state_current[run_states]
+            ops = state_ops[run_states]
+            # Which runs stop at this step
+            ending = np.zeros(len(live), bool)
+            # Runs that took a macro-op are done with this step
+            advanced = live[:0]
+
+            macro = ops == OP_MACRO
+            if macro.any():
+                # Taken whole only when it doesn't go past the step limit, as in run_transitions
+                whole = macro & (steps[live] + macro_steps[run_states] <= limit_step)
+                ops = np.where(macro & ~whole, opcodes[current], ops)
+                if whole.any():
+                    rows = advanced = live[whole]
+                    macro_states = run_states[whole]
+                    normal = macro_normal[macro_states]
+                    self.do_normal(rows[normal >= 0], normal[normal >= 0], values, last_normal, holding_input, input_values, crementing, crement_counts)
+                    last_normal[rows[normal >= 0]] = macro_last_normal[macro_states[normal >= 0]]
+                    crements = macro_crements[macro_states] > 0
+                    crementing[rows[crements]] = True
+                    crement_counts[rows] += macro_delta[macro_states]
+                    steps[rows] += macro_steps[macro_states]
+                    states[rows] = macro_target[macro_states]
+
+                    keep = ~whole
+                    live, run_states, current, ops, ending = live[keep], run_states[keep], current[keep], ops[keep], ending[keep]
+
+            is_normal = ops == OP_NORMAL
+            if is_normal.any():
+                self.do_normal(live[is_normal], current[is_normal], values, last_normal, holding_input, input_values, crementing, crement_counts)
+
+            for op, delta in ((OP_INCREMENT, 1), (OP_DECREMENT, -1)):
+                is_crement = ops == op
+                if is_crement.any():
+                    rows = live[is_crement]
+                    crementing[rows] = True
+                    crement_counts[rows] += delta
+
+            is_output = ops == OP_OUTPUT
+            if is_output.any():
+                rows = live[is_output]
+                broken = (last_normal[rows] < 0) | crementing[rows]
+                if broken.any():
+                    ending[np.flatnonzero(is_output)[broken]] = True
+                good = rows[~broken]
+                output_runs.append(good)
+                output_values.append(values[good, last_normal[good]])
+
+            is_start = ops == OP_START
+            if is_start.any():
+                reentered = steps[live[is_start]] != 0
+                ending[np.flatnonzero(is_start)[reentered]] = True
+
+            if ending.any():
+                for run, state in zip(live[ending].tolist(), run_states[ending].tolist()):
+                    self.end_run(results[run], state, None, run, values, steps, crementing, crement_counts, holding_input, input_values, last_normal)
+
+            transitions = run_states*2 + (values[live, current] >= 1)
+            next_states = next_state[transitions]
+
+            unresolved = ~ending & (next_states < 0)
+            if unresolved.any():
+                for run, state, transition in zip(live[unresolved].tolist(), run_states[unresolved].tolist(), transitions[unresolved].tolist()):
+                    self.end_run(results[run], state, transition, run, values, steps, crementing, crement_counts, holding_input, input_values, last_normal)
+                ending |= unresolved
+
+            reading = ~ending & next_input[transitions] & ~holding_input[live]
+            if reading.any():
+                rows = live[reading]
+                positions = input_positions[rows]
+                exhausted = positions >= self.input_counts[rows]
+                if exhausted.any():
+                    for run in rows[exhausted].tolist():
+                        # What IntegerReader raises when it has nothing more to read
+                        results[run]["status"] = "error"
+                        results[run]["error"] = {"type": "EOFError", "message": "No more input"}
+                    ending[np.flatnonzero(reading)[exhausted]] = True
+                rows = rows[~exhausted]
+                positions = positions[~exhausted]
+                holding_input[rows] = True
+                input_values[rows] = self.inputs[rows, positions]
+                input_positions[rows] = positions + 1
+
+            going = ~ending
+            rows = live[going]
+            states[rows] = next_states[going]
+            steps[rows] += 1
+            live = np.concatenate((rows, advanced))
+
+        if output_runs:
+            runs = np.concatenate(output_runs)
+            outputs = np.concatenate(output_values)
+            # Outputs of each run in the order they were written
+            order = np.argsort(runs, kind="stable")
+            runs, outputs = runs[order], outputs[order]
+            bounds = np.searchsorted(runs, np.arange(run_count+1))
+            for run, result in enumerate(results):
+                run_outputs = outputs[bounds[run]:bounds[run+1]].tolist()
+                result["output"] = "".join(f"{value}\n" for value in run_outputs)
+
+        for run, result in enumerate(results):
+            result["steps"] = int(steps[run])
+
+        return results
+
+    @staticmethod
+    def new_result():
+        # The same fields batch jobs report
+        return {
+            "status": "halted",
+            "output": "",
+            "halt_reason": None,
+            "error": None,
+            "steps": 0,
+        }
+
+    @staticmethod
+    def set_exception(result, exception:Exception):
+        if isinstance(exception, HaltException):
+            result["halt_reason"] = exception.message
+        elif isinstance(exception, CirclesException):
+            result["status"] = "error"
+            result["error"] = exception.to_dict()
+        else:
+            result["status"] = "error"
+            result["error"] = {"type": type(exception).__name__, "message": str(exception)}
+
+    @staticmethod
+    def do_normal(rows, circles, values, last_normal, holding_input, input_values, crementing, crement_counts):
+        last_normal[rows] = circles
+
+        holding = holding_input[rows]
+        values[rows[holding], circles[holding]] = input_values[rows[holding]]
+        holding_input[rows] = False
+
+        adding = crementing[rows]
+        values[rows[adding], circles[adding]] += crement_counts[rows[adding]]
+        crementing[rows] = False
+        crement_counts[rows] = 0
+
+    def end_run(self, result, state:int, transition:int, run:int, values, steps, crementing, crement_counts, holding_input, input_values, last_normal):
+        # The object-level interpreter reports why the run ends, once for every way of ending it
+        # since what it reports only depends on the state and what decided it
+        compiled = compile_program(self.program)
+        current = compiled.state_current[state]
+
+        if transition is None:
+            key = (state, bool(crementing[run]), bool(last_normal[run] >= 0), bool(steps[run] != 0))
+        else:
+            key = (state, transition)
+
+        if key not in self.object_level_results:
+            circles = self.program.circles
+            interpreter = Interpreter(self.program, reader=EmptyReader(), writer=NullWriter())
+            interpreter.previous = circles[compiled.state_previous[state]]
+            interpreter.current = circles[current]
+            interpreter.step_number = int(steps[run])
+            interpreter.values = values[run].tolist()
+            interpreter.crement_mode = CrementModes.CREMENTING if crementing[run] else CrementModes.NOT_CREMENTING
+            interpreter.crement_count = int(crement_counts[run])
+            interpreter.input_mode = InputModes.HOLDING_INPUT if holding_input[run] else InputModes.WAITING_FOR_INPUT
+            interpreter.input_value = int(input_values[run])
+            interpreter.last_normal_circle = None if last_normal[run] < 0 else circles[int(last_normal[run])]
+
+            try:
+                if transition is None:
+                    interpreter.do_current_circle()
+                else:
+                    interpreter.go_next()
+                self.object_level_results[key] = None
+            except Exception as exception:
+                self.object_level_results[key] = exception
+
+        exception = self.object_level_results[key]
+        if exception is not None:
+            self.set_exception(result, exception)
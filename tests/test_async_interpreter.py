@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from circles.async_interpreter import AsyncInterpreter
+from circles.exceptions import HaltException
+from circles.interpreter import RunStatus
+from circles.program import CircleTypes, PathTypes
+
+from test_compiled import build_program
+
+def echo_program():
+    # start -input-> normal -> output, which ends in a dead end
+    return build_program(
+        [CircleTypes.START, CircleTypes.NORMAL, CircleTypes.OUTPUT],
+        [(PathTypes.INPUT, 0, 1), (PathTypes.NORMAL, 1, 2)],
+    )
+
+async def drain(queue:asyncio.Queue):
+    values = []
+    while not queue.empty():
+        values.append(queue.get_nowait())
+    return values
+
+def test_waiting_for_input_times_out(capsys):
+    async def session():
+        loop = asyncio.get_running_loop()
+        inputs, outputs = asyncio.Queue(), asyncio.Queue()
+        interpreter = AsyncInterpreter(echo_program(), inputs, outputs)
+
+        start = loop.time()
+        status = await asyncio.wait_for(interpreter.run(timeout=0.2), 5)
+        waited = loop.time() - start
+
+        # The session can go on once the input comes
+        inputs.put_nowait(7)
+        with pytest.raises(HaltException):
+            await interpreter.run(timeout=5)
+        return status, waited, await drain(outputs)
+
+    status, waited, outputs = asyncio.run(session())
+    assert status == RunStatus.TIME_LIMIT
+    assert 0.2 <= waited < 2
+    assert outputs == [7]
+
+def test_end_of_input_raises(capsys):
+    async def session():
+        inputs, outputs = asyncio.Queue(), asyncio.Queue()
+        inputs.put_nowait(None)
+        await AsyncInterpreter(echo_program(), inputs, outputs).run(timeout=5)
+
+    with pytest.raises(EOFError):
+        asyncio.run(session())
@@ -0,0 +1,69 @@
+import os
+import shutil
+from pathlib import Path
+
+from circles.cache import ProgramCache
+from circles.main import load_program
+from circles.profiling import Profiler
+
+IMAGES = Path(__file__).parent.parent / "images"
+
+def test_second_load_hits(tmp_path):
+    image_path = tmp_path / "program-7.png"
+    shutil.copy(IMAGES / "program-7.png", image_path)
+    cache = ProgramCache(tmp_path / "cache")
+
+    profiler = Profiler()
+    parsed = load_program(str(image_path), {}, cache, profiler)
+    cached = load_program(str(image_path), {}, cache, profiler)
+
+    assert profiler.counters["cache.misses"] == 1
+    assert profiler.counters["cache.hits"] == 1
+    assert cached.to_dict() == parsed.to_dict()
+    assert cached.image_path == str(image_path)
+
+    # Other parser options are another parse
+    load_program(str(image_path), {"adaptive": True}, cache, profiler)
+    assert profiler.counters["cache.misses"] == 2
+
+def test_key_follows_image_and_parser_options():
+    image_bytes = (IMAGES / "program-7.png").read_bytes()
+    key = ProgramCache.key(image_bytes, {})
+
+    assert ProgramCache.key(image_bytes) == key
+    assert ProgramCache.key(image_bytes, {"adaptive": True}) != key
+    assert ProgramCache.key(image_bytes, {"pyramid_level": 1}) != ProgramCache.key(image_bytes, {"pyramid_level": 2})
+    assert ProgramCache.key(image_bytes, {"adaptive": True, "low_memory": True}) == ProgramCache.key(image_bytes, {"low_memory": True, "adaptive": True})
+    assert ProgramCache.key(image_bytes + b"\0", {}) != key
+
+def test_broken_entries_miss(tmp_path):
+    cache = ProgramCache(tmp_path)
+    cache.entry_path("broken").write_bytes(b"not a program")
+
+    assert cache.get("broken") is None
+    assert cache.get("missing") is None
+    assert not cache.entry_path("broken").exists()
+
+def test_evict_down_to_max_bytes(tmp_path):
+    image_path = IMAGES / "program-7.png"
+    program = load_program(str(image_path), {})
+    cache = ProgramCache(tmp_path)
+
+    (tmp_path / "legacy.json").write_text("{}")
+    for i in range(5):
+        cache.put(str(i), program)
+        # Oldest first, a second apart so the modification times order them
+        os.utime(cache.entry_path(str(i)), (i, i))
+
+    # Room for three entries
+    entry_bytes = cache.entry_path("0").stat().st_size
+    cache.max_bytes = entry_bytes*3 + entry_bytes//2
+
+    # Using an entry makes it the most recent one
+    assert cache.get("1", str(image_path)) is not None
+    cache.evict()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["1.circb", "3.circb", "4.circb"]
+
+    cache.clear()
+    assert list(tmp_path.iterdir()) == []
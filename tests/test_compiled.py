@@ -0,0 +1,191 @@
+import io
+import random
+
+import pytest
+
+import circles.interpreter
+from circles.exceptions import CirclesException
+from circles.interpreter import Interpreter, RunStatus
+from circles.program import Circle, Path, Program, CircleTypes, PathTypes
+from circles.streams import IntegerReader, IntegerWriter
+
+# The compiled tables, their macro-ops and skipping ahead through loops have to behave exactly like
+# the object-level stepper, which is what the language is defined by
+
+CIRCLE_TYPES = [CircleTypes.NORMAL, CircleTypes.NORMAL, CircleTypes.INCREMENT, CircleTypes.DECREMENT, CircleTypes.OUTPUT]
+PATH_TYPES = [PathTypes.NORMAL, PathTypes.NORMAL, PathTypes.PRIORITY, PathTypes.CONDITIONAL_PRIORITY, PathTypes.INPUT]
+
+def build_program(types, connections):
+    circles = []
+    for i, circle_type in enumerate(types):
+        circle = Circle(i, (i*10, 0), 5)
+        circle.type = circle_type
+        circles.append(circle)
+
+    paths = []
+    for i, (path_type, first, second) in enumerate(connections):
+        path = Path(i, path_type)
+        path.connect_circle(circles[first])
+        path.connect_circle(circles[second])
+        paths.append(path)
+
+    return Program(None, circles, paths)
+
+def random_program(rng:random.Random):
+    circle_count = rng.randint(2, 9)
+    circles = []
+    for i in range(circle_count):
+        circle = Circle(i, (i*10, 0), 5)
+        circle.type = CircleTypes.START if i == 0 else rng.choice(CIRCLE_TYPES)
+        circles.append(circle)
+
+    paths = []
+    for i in range(rng.randint(1, circle_count+4)):
+        first, second = rng.sample(range(circle_count), 2)
+        path = Path(i, rng.choice(PATH_TYPES))
+        path.connect_circle(circles[first])
+        path.connect_circle(circles[second])
+        paths.append(path)
+
+    return Program(None, circles, paths)
+
+LOOP_TYPES = [CircleTypes.INCREMENT, CircleTypes.DECREMENT, CircleTypes.DECREMENT, CircleTypes.NORMAL]
+
+def random_loop_program(rng:random.Random, loop_circle_types=LOOP_TYPES):
+    # A counter circle going around a loop of crement and normal circles while it is 1 or more,
+    # and out to an output circle once it isn't, random graphs rarely have long loops and
+    # straight runs of crements and normal circles like these
+    loop_types = [rng.choice(loop_circle_types) for _ in range(rng.randint(1, 8))]
+    types = [CircleTypes.START, CircleTypes.NORMAL] + loop_types + [CircleTypes.OUTPUT, CircleTypes.NORMAL]
+
+    loop_end = len(loop_types) + 1
+    connections = [(PathTypes.INPUT, 0, 1), (PathTypes.CONDITIONAL_PRIORITY, 1, 2)]
+    connections += [(PathTypes.NORMAL, i, i+1) for i in range(2, loop_end)]
+    connections += [(PathTypes.NORMAL, loop_end, 1), (PathTypes.PRIORITY, 1, loop_end+1), (PathTypes.NORMAL, loop_end+1, loop_end+2)]
+
+    return build_program(types, connections)
+
+def random_inputs(rng:random.Random, largest:int):
+    return " ".join(str(rng.randint(-largest, largest)) for _ in range(rng.randint(0, 6)))
+
+def outcome(interpreter:Interpreter, outputs:io.StringIO, result):
+    return (
+        result,
+        interpreter.step_number,
+        outputs.getvalue(),
+        list(interpreter.values),
+        interpreter.crement_mode,
+        interpreter.crement_count,
+        interpreter.input_mode,
+        None if interpreter.last_normal_circle is None else interpreter.last_normal_circle.index,
+        interpreter.previous.index,
+        interpreter.current.index,
+    )
+
+def exception_outcome(exception:Exception):
+    circles = [circle.index for circle in getattr(exception, "circles", [])]
+    paths = [path.index for path in getattr(exception, "paths", [])]
+    return (type(exception).__name__, str(exception), circles, paths)
+
+def new_interpreter(program:Program, inputs:str, **options):
+    outputs = io.StringIO()
+    interpreter = Interpreter(program, reader=IntegerReader(io.StringIO(inputs)), writer=IntegerWriter(outputs), **options)
+    return interpreter, outputs
+
+def run_stepping(program:Program, inputs:str, max_steps:int):
+    interpreter, outputs = new_interpreter(program, inputs)
+    result = RunStatus.STEP_LIMIT
+    try:
+        interpreter.start()
+        interpreter.step_number = 0
+        while interpreter.step_number < max_steps:
+            interpreter.step()
+    except (CirclesException, EOFError) as exception:
+        result = exception_outcome(exception)
+    return outcome(interpreter, outputs, result)
+
+def run_compiled(program:Program, inputs:str, max_steps:int, slice_steps:int, accelerate_loops:bool):
+    interpreter, outputs = new_interpreter(program, inputs, accelerate_loops=accelerate_loops)
+    result = None
+    try:
+        while result is None:
+            steps_left = max_steps - max(interpreter.step_number, 0)
+            status = interpreter.run(min(slice_steps, steps_left))
+            if status != RunStatus.STEP_LIMIT or interpreter.step_number >= max_steps:
+                result = status
+    except (CirclesException, EOFError) as exception:
+        result = exception_outcome(exception)
+    return outcome(interpreter, outputs, result)
+
+@pytest.fixture
+def short_loop_probes(monkeypatch):
+    # Look for loops to skip every few steps instead of every 65536, so short runs skip too
+    monkeypatch.setattr(circles.interpreter, "LOOP_PROBE_INTERVAL", 16)
+
+@pytest.mark.parametrize("seed", range(4))
+def test_compiled_matches_stepping(seed, short_loop_probes, capsys):
+    rng = random.Random(seed)
+    for _ in range(250):
+        kind = rng.random()
+        if kind < 0.6:
+            program = random_program(rng)
+        elif kind < 0.9:
+            program = random_loop_program(rng)
+        else:
+            program = random_loop_program(rng, [CircleTypes.NORMAL])
+        inputs = random_inputs(rng, 20)
+        max_steps = rng.choice([50, 333, 2000])
+
+        expected = run_stepping(program, inputs, max_steps)
+        for accelerate_loops in (False, True):
+            for slice_steps in (max_steps, 1, 7, 64):
+                assert run_compiled(program, inputs, max_steps, slice_steps, accelerate_loops) == expected
+
+@pytest.mark.parametrize("seed", range(4))
+def test_accelerated_loops_match_compiled(seed, short_loop_probes, capsys):
+    # Long loops are too slow to step through one step at a time, the compiled run without
+    # skipping ahead stands in for the stepper, which the test above holds it to
+    rng = random.Random(seed)
+    for _ in range(75):
+        program = random_program(rng) if rng.random() < 0.5 else random_loop_program(rng)
+        inputs = random_inputs(rng, 10**5)
+        max_steps = rng.choice([500, 20000, 300000])
+
+        expected = run_compiled(program, inputs, max_steps, max_steps, False)
+        for slice_steps in (max_steps, 97, 5000):
+            assert run_compiled(program, inputs, max_steps, slice_steps, True) == expected
+
+def countdown_program():
+    # start -input-> counter, which goes around two decrements while it is 1 or more and then
+    # out to an output circle
+    return build_program(
+        [CircleTypes.START, CircleTypes.NORMAL, CircleTypes.DECREMENT, CircleTypes.DECREMENT, CircleTypes.OUTPUT],
+        [
+            (PathTypes.INPUT, 0, 1),
+            (PathTypes.CONDITIONAL_PRIORITY, 1, 2),
+            (PathTypes.NORMAL, 2, 3),
+            (PathTypes.NORMAL, 3, 1),
+            (PathTypes.PRIORITY, 1, 4),
+        ],
+    )
+
+def test_straight_normal_circles_fold(capsys):
+    # start -input-> a run of normal circles -> output, only the first normal circle takes the
+    # input and the output is the value of the last one
+    for length in (2, 3, 9):
+        program = build_program(
+            [CircleTypes.START] + [CircleTypes.NORMAL]*length + [CircleTypes.OUTPUT],
+            [(PathTypes.INPUT, 0, 1)] + [(PathTypes.NORMAL, i, i+1) for i in range(1, length+1)],
+        )
+        compiled = circles.interpreter.compile_program(program)
+        assert compiled.macro_steps[compiled.state_index[(0, 1)]] == length
+
+        for inputs in ("5", "0"):
+            expected = run_stepping(program, inputs, 100)
+            assert run_compiled(program, inputs, 100, 100, False) == expected
+
+def test_countdown_skips_ahead(capsys):
+    program = countdown_program()
+    for value in (0, 1, 2, 7, 10**6+1):
+        expected = run_stepping(program, str(value), 10**7) if value < 100 else run_compiled(program, str(value), 10**7, 10**7, False)
+        assert run_compiled(program, str(value), 10**7, 10**7, True) == expected
@@ -0,0 +1,24 @@
+import importlib
+import sys
+
+import pytest
+
+from circles.main import SUBCOMMANDS, main
+
+@pytest.mark.parametrize("name", sorted(SUBCOMMANDS))
+def test_subcommands_run_their_main(name, monkeypatch, capsys):
+    module, function, _ = SUBCOMMANDS[name]
+    assert callable(getattr(importlib.import_module(module), function))
+
+    monkeypatch.setattr(sys, "argv", ["circles", name, "--help"])
+    with pytest.raises(SystemExit):
+        main()
+    assert f"python -m circles {name}" in capsys.readouterr().out
+
+def test_help_lists_subcommands(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["circles", "--help"])
+    with pytest.raises(SystemExit):
+        main()
+    help_text = capsys.readouterr().out
+    for name in SUBCOMMANDS:
+        assert f"  {name} " in help_text
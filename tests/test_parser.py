@@ -0,0 +1,95 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from circles.main import parse_image_bytes
+from circles.parser import Parser, IncrementalParser
+
+IMAGES = Path(__file__).parent.parent / "images"
+
+def summary(program):
+    circles = [(circle.center, circle.radius, circle.type) for circle in program.circles]
+    paths = [(path.type, [circle.index for circle in path.circles]) for path in program.paths]
+    return circles, paths
+
+def recoloured(image_bytes:bytes, color):
+    # The same program drawn with coloured strokes instead of black ones
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    image[cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) < 105] = color
+    return cv2.imencode(".png", image)[1].tobytes()
+
+@pytest.mark.parametrize("name", ["program-1", "program-6"])
+@pytest.mark.parametrize("color", [None, (40, 110, 200), (90, 90, 150)])
+def test_low_memory_parses_the_same(name, color):
+    image_bytes = (IMAGES / f"{name}.png").read_bytes()
+    if color is not None:
+        image_bytes = recoloured(image_bytes, color)
+
+    expected = parse_image_bytes(image_bytes, {})
+    assert expected is not None
+    assert summary(parse_image_bytes(image_bytes, {"low_memory": True})) == summary(expected)
+
+def unnumbered(program):
+    # Circles and paths that stay keep their indices in an incremental parse, so compare without them
+    circles, paths = summary(program)
+    paths = [(path_type, [circles[index][0] for index in indices]) for path_type, indices in paths]
+    return sorted(circles, key=str), sorted(paths, key=str)
+
+def edited(image, circle, edit:str):
+    image = image.copy()
+    (x, y), radius = circle.center, circle.radius
+    if edit == "erase":
+        cv2.rectangle(image, (x-radius-3, y-radius-3), (x+radius+3, y+radius+3), (255, 255, 255), -1)
+    elif edit == "inner circle":
+        cv2.circle(image, (x, y), max(radius//3, 3), (0, 0, 0), 2)
+    elif edit == "circle beside":
+        cv2.circle(image, (x+radius+5, y), radius//2, (0, 0, 0), 2)
+    else:
+        cv2.line(image, (x-radius, y+radius), (x+radius, y+2*radius), (0, 0, 0), 3)
+    return image
+
+def parse_result(parser:Parser):
+    # Strokes the parser can't make sense of fail the same way both ways
+    try:
+        return parser.parse()
+    except Exception as exception:
+        return type(exception).__name__
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("name", ["program-4", "program-5", "program-7"])
+@pytest.mark.parametrize("edit", ["erase", "inner circle", "circle beside", "scribble"])
+def test_incremental_parse_matches_full_parse(name, edit):
+    image = cv2.imread(str(IMAGES / f"{name}.png"))
+    previous = Parser(image).parse()
+    assert IncrementalParser(previous, image.copy()).parse() is previous
+
+    for circle in previous.circles:
+        new_image = edited(image, circle, edit)
+        program = parse_result(IncrementalParser(previous, new_image))
+        expected = parse_result(Parser(new_image))
+        if isinstance(expected, str):
+            assert program == expected
+            continue
+        assert unnumbered(program) == unnumbered(expected)
+
+        # Circles that are still there keep their indices while there are still that many circles
+        previous_indices = {(circle.center, circle.radius): circle.index for circle in previous.circles}
+        for kept in program.circles:
+            previous_index = previous_indices.get((kept.center, kept.radius))
+            if previous_index is not None and previous_index < len(program.circles):
+                assert kept.index == previous_index
+
+@pytest.mark.parametrize("center", [(780, 420), (90, 420)])
+def test_incremental_parse_finds_new_circles(center):
+    # Drawn where program-5 has nothing, so only running Hough again can find it
+    image = cv2.imread(str(IMAGES / "program-5.png"))
+    previous = Parser(image).parse()
+
+    new_image = image.copy()
+    cv2.circle(new_image, center, 55, (255, 255, 255), -1)
+    cv2.circle(new_image, center, 55, (0, 0, 0), 6)
+    program = IncrementalParser(previous, new_image).parse()
+    assert len(program.circles) == len(previous.circles) + 1
+    assert unnumbered(program) == unnumbered(Parser(new_image).parse())
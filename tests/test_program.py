@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pytest
+
+from circles.main import parse_image_bytes
+from circles.program import Program, CIRCB_HEADER, CIRCB_MAGIC, CIRCB_VERSION
+
+IMAGES = Path(__file__).parent.parent / "images"
+
+def parse_or_skip(image_path:Path):
+    try:
+        program = parse_image_bytes(image_path.read_bytes(), {})
+    except Exception as exception:
+        pytest.skip(f"{image_path.name} doesn't parse ({type(exception).__name__})")
+    if program is None:
+        pytest.skip(f"{image_path.name} doesn't parse")
+    return program
+
+@pytest.mark.parametrize("image_path", sorted(IMAGES.glob("*.png")), ids=lambda path: path.stem)
+def test_circb_round_trip(image_path, tmp_path):
+    program = parse_or_skip(image_path)
+    program.save(tmp_path / "program.circb")
+
+    loaded = Program.load(tmp_path / "program.circb")
+    assert loaded.to_dict() == program.to_dict()
+    # Every circle also has its paths in the same order
+    assert [[path.index for path in circle.paths] for circle in loaded.circles] == [[path.index for path in circle.paths] for circle in program.circles]
+
+@pytest.fixture
+def saved(tmp_path):
+    program = parse_or_skip(IMAGES / "program-6.png")
+    path = tmp_path / "program.circb"
+    program.save(path)
+    return path
+
+def test_circb_bad_magic(saved):
+    data = saved.read_bytes()
+    saved.write_bytes(b"NOTCB" + data[len(CIRCB_MAGIC):])
+    with pytest.raises(ValueError, match="not a .circb file"):
+        Program.load(saved)
+
+def test_circb_wrong_version(saved):
+    data = bytearray(saved.read_bytes())
+    data[len(CIRCB_MAGIC)] = CIRCB_VERSION + 1
+    saved.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="version"):
+        Program.load(saved)
+
+@pytest.mark.parametrize("cut", [0, CIRCB_HEADER.size - 1, CIRCB_HEADER.size, -1])
+def test_circb_truncated(saved, cut):
+    data = saved.read_bytes()
+    saved.write_bytes(data[:cut] if cut >= 0 else data[:len(data) + cut])
+    with pytest.raises(ValueError):
+        Program.load(saved)
@@ -0,0 +1,81 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from circles.cache import ProgramCache
+from circles.server import ProgramServer
+
+from test_async_interpreter import echo_program
+
+IMAGES = Path(__file__).parent.parent / "images"
+
+pytestmark = pytest.mark.skipif(not hasattr(asyncio, "start_unix_server"), reason="needs Unix sockets")
+
+async def request(socket_path:Path, message:dict, lines=()):
+    # Everything the server sends back, one message per line
+    reader, writer = await asyncio.open_unix_connection(str(socket_path))
+    writer.write(json.dumps(message).encode() + b"\n")
+    for line in lines:
+        writer.write(line + b"\n")
+    await writer.drain()
+
+    replies = []
+    while True:
+        line = await asyncio.wait_for(reader.readline(), 30)
+        if not line:
+            break
+        replies.append(json.loads(line))
+    writer.close()
+    return replies
+
+def serving(tmp_path:Path, session):
+    async def run():
+        with ThreadPoolExecutor(2) as executor:
+            socket_path = tmp_path / "serve.sock"
+            program_server = ProgramServer(executor, ProgramCache(tmp_path / "cache"))
+            server = await asyncio.start_unix_server(program_server.handle, str(socket_path))
+            async with server:
+                return await session(socket_path)
+    return asyncio.run(run())
+
+def test_runs_programs(tmp_path, capsys):
+    echo_path = tmp_path / "echo.circb"
+    echo_program().save(echo_path)
+
+    async def session(socket_path):
+        image = {"path": str(IMAGES / "program-7.png"), "max_steps": 1000}
+        inputs = [b'{"input": 3}', b'{"input": 4}', b'{"end_of_input": true}']
+        first = await request(socket_path, image, inputs)
+        second = await request(socket_path, image, inputs)
+        echo = await request(socket_path, {"path": str(echo_path)}, [b'{"input": 7}', b'{"end_of_input": true}'])
+        return first, second, echo
+
+    first, second, echo = serving(tmp_path, session)
+
+    assert first[-1]["status"] == "step_limit"
+    assert first[-1]["steps"] == 1000
+    assert not first[-1]["cached"]
+    # Parsed once, kept in memory and written to the disk cache
+    assert second[-1]["cached"]
+    assert len(list((tmp_path / "cache").glob("*.circb"))) == 1
+
+    assert echo[:-1] == [{"output": 7}]
+    assert echo[-1]["status"] == "halted"
+    assert echo[-1]["error"] is None
+
+def test_malformed_input_line_is_an_error(tmp_path, capsys):
+    echo_path = tmp_path / "echo.circb"
+    echo_program().save(echo_path)
+
+    async def session(socket_path):
+        return await request(socket_path, {"path": str(echo_path)}, [b'{"input": "seven"}'])
+
+    replies = serving(tmp_path, session)
+
+    assert len(replies) == 1
+    assert replies[0]["status"] == "error"
+    assert replies[0]["error"]["type"] == "ValueError"
+    assert "seven" in replies[0]["error"]["message"]
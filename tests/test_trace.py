@@ -0,0 +1,75 @@
+import pytest
+
+from circles.exceptions import HaltException
+from circles.program import CircleTypes, PathTypes
+from circles.trace import KEYFRAME_INTERVAL, VALUE_MIN, VALUE_MAX, TraceRecorder, TraceReplay
+
+from test_compiled import build_program, countdown_program, new_interpreter
+
+def stepped_values(program, inputs:str):
+    # The values before every step up to the one that halts, from the object-level stepper
+    interpreter, _ = new_interpreter(program, inputs)
+    values = []
+    with pytest.raises(HaltException):
+        interpreter.start()
+        interpreter.step_number = 0
+        while True:
+            values.append(list(interpreter.values))
+            interpreter.step()
+    return values
+
+def recorded(program, inputs:str, tmp_path, capacity:int=None):
+    trace = TraceRecorder(capacity)
+    interpreter, _ = new_interpreter(program, inputs, trace=trace)
+    with pytest.raises(HaltException):
+        interpreter.run()
+
+    trace_path = tmp_path / "run.circt"
+    trace.save(str(trace_path))
+    return TraceReplay(str(trace_path), program)
+
+@pytest.mark.parametrize("capacity", [None, 5000, 1])
+def test_replay_matches_stepping(capacity, tmp_path, capsys):
+    # Around 3 keyframes of counting down
+    program = countdown_program()
+    expected = stepped_values(program, "4000")
+    replay = recorded(program, "4000", tmp_path, capacity)
+
+    last_step = len(expected) - 1
+    assert replay.last_step == last_step
+    assert replay.first_step == (0 if capacity is None else last_step - capacity)
+
+    steps = [replay.first_step, replay.last_step]
+    for keyframe in range(1, 4):
+        steps += [keyframe*KEYFRAME_INTERVAL - 1, keyframe*KEYFRAME_INTERVAL, keyframe*KEYFRAME_INTERVAL + 1, keyframe*KEYFRAME_INTERVAL + 777]
+    for step in steps:
+        if replay.first_step <= step <= replay.last_step:
+            assert replay.values_at(step).tolist() == expected[step]
+
+    with pytest.raises(IndexError):
+        replay.values_at(last_step + 1)
+
+@pytest.mark.parametrize("capacity", [None, 1])
+def test_deltas_past_64_bits_wrap(capacity, tmp_path):
+    # From the smallest value to the largest is a delta that doesn't fit in 64 bits
+    program = build_program([CircleTypes.START, CircleTypes.NORMAL], [(PathTypes.NORMAL, 0, 1)])
+    values = [0, VALUE_MIN, VALUE_MAX, VALUE_MIN, -1]
+
+    trace = TraceRecorder(capacity)
+    trace.begin(0, [0, values[0]])
+    for before, after in zip(values, values[1:]):
+        trace.record(1, 0, after - before, after)
+    trace.save(str(tmp_path / "run.circt"))
+
+    replay = TraceReplay(str(tmp_path / "run.circt"), program)
+    for step in range(replay.first_step, replay.last_step + 1):
+        assert replay.values_at(step).tolist() == [0, values[step]]
+
+def test_values_past_64_bits_raise(capsys):
+    program = build_program(
+        [CircleTypes.START, CircleTypes.NORMAL, CircleTypes.OUTPUT],
+        [(PathTypes.INPUT, 0, 1), (PathTypes.NORMAL, 1, 2)],
+    )
+    interpreter, _ = new_interpreter(program, str(2**63), trace=TraceRecorder())
+    with pytest.raises(OverflowError):
+        interpreter.run()
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from circles.exceptions import CirclesException, HaltException
+from circles.interpreter import RunStatus
+from circles.trace import TraceRecorder
+from circles.validator import validate_program
+
+from test_compiled import random_program, random_loop_program, new_interpreter, outcome, exception_outcome
+
+# Whatever the validator accepts has to run the same without the checks, and whatever it reports
+# has to be something a run can actually raise
+
+INPUT_VALUES = [-2, -1, 0, 0, 1, 1, 2, 3, 5]
+
+def error_key(exception:CirclesException):
+    return (type(exception).__name__, tuple(circle.index for circle in exception.circles), tuple(path.index for path in exception.paths))
+
+def random_program_of_any_kind(rng:random.Random):
+    return random_program(rng) if rng.random() < 0.7 else random_loop_program(rng)
+
+def random_inputs(rng:random.Random):
+    return " ".join(str(rng.choice(INPUT_VALUES)) for _ in range(rng.randint(0, 10)))
+
+def run(program, inputs:str, checked:bool, trace=None):
+    interpreter, outputs = new_interpreter(program, inputs, checked=checked, trace=trace)
+    try:
+        result = interpreter.run(2000)
+    except (CirclesException, EOFError) as exception:
+        result = exception_outcome(exception)
+    return outcome(interpreter, outputs, result)
+
+def stepper_error(program, inputs:str):
+    interpreter, _ = new_interpreter(program, inputs)
+    try:
+        interpreter.start()
+        interpreter.step_number = 0
+        while interpreter.step_number < 3000:
+            interpreter.step()
+    except (HaltException, EOFError):
+        return None
+    except CirclesException as exception:
+        return error_key(exception)
+    return None
+
+@pytest.mark.parametrize("seed", range(4))
+def test_accepted_programs_run_the_same_unchecked(seed, capsys):
+    rng = random.Random(seed)
+    accepted = 0
+    for _ in range(400):
+        program = random_program_of_any_kind(rng)
+        if not validate_program(program).ok:
+            continue
+        accepted += 1
+
+        for _ in range(3):
+            inputs = random_inputs(rng)
+            assert run(program, inputs, False) == run(program, inputs, True)
+            assert run(program, inputs, False, TraceRecorder()) == run(program, inputs, True, TraceRecorder())
+    assert accepted > 0
+
+@pytest.mark.parametrize("seed", range(4))
+def test_errors_are_reached_by_runs(seed, capsys):
+    rng = random.Random(seed)
+    for _ in range(500):
+        program = random_program_of_any_kind(rng)
+        reported = {error_key(error) for error in validate_program(program).errors}
+
+        reached = set()
+        for _ in range(200):
+            error = stepper_error(program, random_inputs(rng))
+            if error is not None:
+                # Nothing a run raises can be missing from the report
+                assert error in reported
+                reached.add(error)
+            if reached == reported:
+                break
+
+        # And everything in the report has to be raised by some run
+        assert reached == reported
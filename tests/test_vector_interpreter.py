@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+import pytest
+
+from circles.exceptions import CirclesException
+from circles.interpreter import RunStatus
+from circles.program import CircleTypes
+from circles.vector_interpreter import VectorInterpreter
+
+from test_compiled import new_interpreter, random_program, random_loop_program
+
+# Running in lock step has to end every run exactly the way the interpreter ends it alone
+
+OUTPUT_LOOP_TYPES = [CircleTypes.NORMAL, CircleTypes.NORMAL, CircleTypes.OUTPUT, CircleTypes.DECREMENT]
+
+def run_alone(program, inputs, max_steps:int):
+    interpreter, outputs = new_interpreter(program, " ".join(map(str, inputs)))
+    result = VectorInterpreter.new_result()
+    try:
+        if interpreter.run(max_steps) == RunStatus.STEP_LIMIT:
+            result["status"] = "step_limit"
+    except (CirclesException, EOFError) as exception:
+        VectorInterpreter.set_exception(result, exception)
+    result["output"] = outputs.getvalue()
+    result["steps"] = max(interpreter.step_number, 0)
+    return result, interpreter.values
+
+def padded(runs):
+    inputs = np.zeros((len(runs), max(map(len, runs), default=0)), np.int64)
+    for i, run_inputs in enumerate(runs):
+        inputs[i, :len(run_inputs)] = run_inputs
+    return inputs, [len(run_inputs) for run_inputs in runs]
+
+@pytest.mark.parametrize("seed", range(4))
+def test_lock_step_matches_interpreter(seed, capsys):
+    rng = random.Random(seed)
+    for _ in range(100):
+        kind = rng.random()
+        if kind < 0.5:
+            program = random_program(rng)
+        elif kind < 0.8:
+            program = random_loop_program(rng)
+        else:
+            # Outputs straight after runs of normal circles write the last one of them
+            program = random_loop_program(rng, OUTPUT_LOOP_TYPES)
+        runs = [[rng.randint(-3, 20) for _ in range(rng.randint(0, 6))] for _ in range(rng.randint(1, 12))]
+        max_steps = rng.choice([50, 333, 2000])
+
+        vector_interpreter = VectorInterpreter(program, *padded(runs))
+        results = vector_interpreter.run(max_steps)
+
+        for run, run_inputs in enumerate(runs):
+            result, values = run_alone(program, run_inputs, max_steps)
+            assert results[run] == result
+            assert vector_interpreter.values[run].tolist() == values
+
+def test_inputs_past_64_bits_raise(capsys):
+    program = random_loop_program(random.Random(0))
+    for value in (2**63, -2**63-1):
+        with pytest.raises(OverflowError, match="64 bits"):
+            VectorInterpreter(program, [[1], [value]])
+
+    # The largest values that fit run like any other
+    inputs = [[2**63-1], [-2**63]]
+    vector_interpreter = VectorInterpreter(program, inputs)
+    results = vector_interpreter.run(100)
+    for run, run_inputs in enumerate(inputs):
+        assert results[run] == run_alone(program, run_inputs, 100)[0]